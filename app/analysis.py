@@ -0,0 +1,60 @@
+import functools
+import numpy as np
+from config import WINDOW_SIZE, HOP_SIZE, WINDOW_FUNCTION, ANALYSIS_CACHE
+from scale import FrequencyScale
+
+
+WINDOW_FUNCTIONS = {
+    "hann": np.hanning,
+    "hamming": np.hamming,
+    "blackman": np.blackman,
+    "rectangular": np.ones,
+}
+
+
+@functools.lru_cache(maxsize=ANALYSIS_CACHE)
+def window_function(kind, size):
+    taper = WINDOW_FUNCTIONS[kind](size)
+    taper.flags.writeable = False   # shared by every caller
+    return taper
+
+
+@functools.lru_cache(maxsize=ANALYSIS_CACHE)
+def frequency_scale(kind, bins, sample_rate, fft_size):
+    # the filterbank matrices are the expensive part, so they are kept per configuration too
+    return FrequencyScale(kind, bins, sample_rate=sample_rate, fft_size=fft_size)
+
+
+class Analysis:
+    """
+    The STFT settings, window size, hop and window function, which can all change while running.
+
+    Instances never change, replace() makes a new one, so a worker thread can hold on to the one it
+    started a batch with. The window arrays and frequency scales they need are cached, so switching
+    back and forth between settings costs nothing after the first time.
+    """
+
+    def __init__(self, window_size=WINDOW_SIZE, hop_size=HOP_SIZE, window=WINDOW_FUNCTION):
+        if window not in WINDOW_FUNCTIONS:
+            raise ValueError(f"unknown window function: {window}")
+        if not 64 <= window_size <= 2 ** 15:
+            raise ValueError(f"window size out of range: {window_size}")
+        if not 1 <= hop_size <= window_size:
+            raise ValueError(f"hop size must be between 1 and the window size: {hop_size}")
+
+        self.window_size = int(window_size)
+        self.hop_size = int(hop_size)
+        self.window = window
+        self.bins = self.window_size // 2 + 1
+        self.taper = window_function(window, self.window_size)
+
+    def __repr__(self):
+        return f"Analysis(window_size={self.window_size}, hop_size={self.hop_size}, window={self.window!r})"
+
+    def replace(self, **changes):
+        settings = {"window_size": self.window_size, "hop_size": self.hop_size, "window": self.window}
+        settings.update(changes)
+        return Analysis(**settings)
+
+    def scale(self, kind, bins, sample_rate):
+        return frequency_scale(kind, bins, sample_rate, self.window_size)
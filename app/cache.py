@@ -0,0 +1,119 @@
+import hashlib
+import numpy as np
+import os
+import threading
+import time
+from config import STFT_CACHE_DIR, STFT_CACHE_BYTES
+from metrics import metrics
+from recorder import NpyWriter
+from source import ArraySource
+from spectrogram import stft_slice, stft_db
+from utils import logger
+
+
+# hops analysed per batch while filling the cache
+CACHE_HOPS = 4096
+
+# entries being written, which eviction leaves alone
+PARTIAL_SUFFIX = ".npy.part"
+
+
+def content_hash(file_name, block=2 ** 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_name, 'rb') as f:
+        while chunk := f.read(block):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class STFTCache:
+    """
+    Spectrogram levels of whole files, kept on disk as (hops, channels, bins) float16 .npy files.
+
+    Entries are keyed by a hash of the file contents plus everything the levels depend on: sample rate,
+    channels, window size, hop, window function and frequency scale. They are memory mapped when used,
+    so any span of a file is a slice read. The modification time of an entry doubles as its last use,
+    and the least recently used entries are deleted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory=STFT_CACHE_DIR, max_bytes=STFT_CACHE_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hashes = {}    # (file name, size, modification time) -> content hash, so files are hashed once
+
+        # left behind by a run that died half way through writing an entry
+        for name in os.listdir(directory):
+            if name.endswith(PARTIAL_SUFFIX):
+                os.remove(os.path.join(directory, name))
+
+    def key(self, file_name, rate, channels, analysis, scale):
+        stat = os.stat(file_name)
+        identity = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+        if identity not in self.hashes:
+            self.hashes[identity] = content_hash(file_name)
+        return (f"{self.hashes[identity]}-{rate}-{channels}-{analysis.window_size}-{analysis.hop_size}"
+                f"-{analysis.window}-{scale.kind}{scale.bins}")
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return np.load(path, mmap_mode='r')
+
+    def levels(self, file_name, channels, analysis, scale):
+        """
+        Memory mapped levels of every hop of the file, analysed first if they aren't cached yet.
+        """
+        source = ArraySource(file_name, realtime=False, channels=channels)
+        source.configure(analysis)
+        key = self.key(file_name, source.rate, channels, analysis, scale)
+
+        levels = self.load(key)
+        if levels is not None:
+            metrics.count("stft_cache_hits")
+            return levels
+
+        metrics.count("stft_cache_misses")
+        start = time.perf_counter()
+        # written under a temporary name and renamed into place, so a half written entry is never loaded,
+        # one per thread, as changing the settings and back again can build the same entry twice at once
+        writer = NpyWriter(self.directory, f"{key}-{os.getpid()}-{threading.get_ident()}", float('inf'), float('inf'))
+        writer.suffix = PARTIAL_SUFFIX
+        while True:
+            windows = source.get_many(CACHE_HOPS)
+            if windows.shape[1] == 0:
+                break
+            batch = stft_db(scale.apply(np.abs(stft_slice(windows, analysis))))
+            writer.write(batch.transpose(1, 0, 2).astype('f2'))
+        source.release()
+
+        if writer.number == 0:
+            return None     # shorter than a window
+        writer.close()
+        os.replace(os.path.join(self.directory, f"{writer.name}-0001{PARTIAL_SUFFIX}"), self.path(key))
+        logger.info(f"cached {writer.frames} hops of {file_name} in {time.perf_counter() - start:.2f}s")
+
+        self.evict(keep=key)
+        return self.load(key)
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") and not name.endswith(PARTIAL_SUFFIX) and name != f"{keep}.npy":
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += os.path.getsize(self.path(keep))
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            logger.info(f"evicted {name} from the stft cache")
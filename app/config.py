@@ -1,7 +1,68 @@
 WINDOW_WIDTH = 1600
 WINDOW_HEIGHT = 900
 
-SAMPLE_RATE = 22050
+SAMPLE_RATE = 22050             # analysis rate when not running at the native rate
+NATIVE_RATE = True              # analyse at the device or file rate rather than resampling to SAMPLE_RATE
 BUFFER_SIZE = 1024
 WINDOW_SIZE = 1024
 HOP_SIZE = 200
+
+# capacity of the source ring buffer in samples (~12 seconds at SAMPLE_RATE)
+RING_SIZE = 2 ** 18
+
+# decoded samples kept ahead of file playback (~6 seconds at SAMPLE_RATE)
+READ_AHEAD = 2 ** 17
+
+# most a quiet file is turned up by, its peak is only known as far as decoding has got, e.g. a quiet intro
+NORMALISE_MAX_GAIN = 4.0
+
+# per-frame instrumentation, see metrics.py
+METRICS = False
+METRICS_OVERLAY = False
+METRICS_DUMP = None             # path of a JSON file to dump the stats to every METRICS_DUMP_INTERVAL seconds
+METRICS_DUMP_INTERVAL = 5.0
+METRICS_HISTORY = 600           # samples kept by each rolling histogram, ~10 seconds of frames
+
+# frame scheduler, see scheduler.py
+MAX_LATENCY = 0.1               # seconds the display may fall behind the audio before catching up
+CATCH_UP = "batch"              # "batch", "skip" or "decimate"
+
+# analysis worker, see pipeline.py
+ANALYSIS_THREAD = True
+ANALYSIS_QUEUE = 256            # analysed hops buffered between the worker and the render thread
+
+# frequency axis of the spectrogram, "linear", "log" or "mel", see scale.py
+FREQUENCY_SCALE = "linear"
+FREQUENCY_BINS = 256            # display rows for the log and mel axes, linear always uses the FFT bins
+
+# long term spectrogram history on disk, see history.py, None to disable
+HISTORY_DIR = None
+HISTORY_LEVELS = 12             # zoom levels, the coarsest one has a column per 2 ** 11 hops
+HISTORY_CHUNK = 4096            # columns the files grow by
+HISTORY_RANGE = (-80.0, 40.0)   # dB range of the 8 bit quantisation
+
+# capture channels, each one gets its own wave and spectrogram tile
+CHANNELS = 1
+
+# capture to disk, see recorder.py, None to disable
+RECORD_DIR = None
+RECORD_COLUMNS = False          # also record the spectrogram columns as .npy
+RECORD_QUEUE = 256              # blocks waiting for the disk before new ones are dropped
+RECORD_MAX_BYTES = 2 ** 28      # start a new file after this many bytes
+RECORD_MAX_SECONDS = 600        # or after this many seconds
+
+# window function of the STFT, one of analysis.WINDOW_FUNCTIONS, all three STFT settings can be changed at runtime
+WINDOW_FUNCTION = "hann"
+ANALYSIS_CACHE = 16             # window functions and frequency scales kept around for switching back
+
+# on disk cache of the spectrogram levels of whole files, see cache.py, None to disable
+STFT_CACHE_DIR = None
+STFT_CACHE_BYTES = 2 ** 32      # least recently used files are evicted beyond this
+
+# per hop spectral features for alerting, see features.py
+FEATURES = False
+FEATURES_OVERLAY = False
+FEATURE_HISTORY = 4096          # newest hops of features kept in memory
+ONSET_THRESHOLD = 1.5           # flux has to be this many times its recent average to count as an onset
+ONSET_FLOOR = 0.01              # and above this, so near silence doesn't trigger
+ONSET_WINDOW = 32               # hops the average covers
@@ -0,0 +1,297 @@
+import collections
+import math
+import numpy as np
+import struct
+import threading
+from config import SAMPLE_RATE, BUFFER_SIZE, READ_AHEAD, NORMALISE_MAX_GAIN
+from ring import RingBuffer
+from utils import logger
+
+
+# (format tag, bits per sample) -> (dtype, scale to +/-1.0) for the WAV layouts that can be memory mapped
+WAV_FORMATS = {
+    (1, 16): ('<i2', 1 / 2 ** 15),
+    (1, 32): ('<i4', 1 / 2 ** 31),
+    (3, 32): ('<f4', 1.0),
+    (3, 64): ('<f8', 1.0),
+}
+
+
+def wav_memmap(file_name):
+    """
+    Memory map the sample data of a WAV file.
+
+    Returns (samples, sample rate, scale), where samples is a read only (frames, channels) array,
+    or None if the file isn't a WAV file in one of the WAV_FORMATS layouts.
+    """
+    with open(file_name, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WAVE':
+            return None
+
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            name, size = struct.unpack('<4sI', chunk)
+            if name == b'data':
+                offset = f.tell()
+                break
+            body = f.read(size + size % 2)
+            if name == b'fmt ':
+                tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+                if tag == 0xFFFE and size >= 26:
+                    tag = struct.unpack('<H', body[24:26])[0]     # WAVE_FORMAT_EXTENSIBLE sub-format
+                fmt = tag, channels, rate, bits
+
+        f.seek(0, 2)
+        file_size = f.tell()
+
+    if fmt is None or (fmt[0], fmt[3]) not in WAV_FORMATS:
+        return None
+
+    tag, channels, rate, bits = fmt
+    dtype, scale = WAV_FORMATS[(tag, bits)]
+    # streamed WAVs often leave the data size unset, so never trust it past the end of the file
+    frames = min(size, file_size - offset) // (channels * bits // 8)
+    samples = np.memmap(file_name, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+    return samples, rate, scale
+
+
+def normalise_gain(peak, target_level=0.95, min_threshold=0.1, max_gain=NORMALISE_MAX_GAIN):
+    """
+    Gain that normalises audio with the given peak amplitude to the target level.
+
+    Args:
+        peak: Peak amplitude of the audio heard so far
+        target_level: Target peak amplitude (default 0.95)
+        min_threshold: Minimum level below which to amplify (default 0.1)
+        max_gain: Largest gain to amplify by, as the peak so far can be far below the peak of the whole file
+    """
+    if peak == 0:
+        return 1.0
+    if peak > 1.0 or peak < min_threshold:
+        return min(target_level / peak, max_gain)
+    return 1.0
+
+
+class Decoder:
+    """
+    Decodes an audio file block by block into float32 samples at the given rate, or at the file's own
+    rate when rate is None.
+
+    Blocks are mono samples by default, or (channels, frames) arrays when channels is given, with the
+    file's channels repeated or averaged down to match. WAV files are read straight from a memory map,
+    anything else goes through soundfile, and blocks at a different sample rate are resampled as a stream.
+    """
+
+    def __init__(self, file_name, rate=SAMPLE_RATE, channels=None):
+        self.channels = channels
+        self.file = None
+        self.samples = None
+        self.position = 0
+        self.done = False
+
+        wav = wav_memmap(file_name)
+        if wav is not None:
+            self.samples, self.file_rate, self.scale = wav
+        else:
+            import soundfile
+            self.file = soundfile.SoundFile(file_name)
+            self.file_rate = self.file.samplerate
+
+        self.rate = rate or self.file_rate
+        self.resampler = None
+        if self.rate != self.file_rate:
+            self.resampler = self.create_resampler()
+
+    def create_resampler(self):
+        import soxr
+        return soxr.ResampleStream(self.file_rate, self.rate, self.channels or 1, dtype='float32')
+
+    @property
+    def file_frames(self):
+        return len(self.samples) if self.samples is not None else self.file.frames
+
+    @property
+    def frames(self):
+        # length of the file at the output rate
+        return self.file_frames * self.rate // self.file_rate
+
+    def seek(self, frame):
+        """
+        Carry on decoding from the given frame, counted at the output rate.
+        """
+        position = min(frame * self.file_rate // self.rate, self.file_frames)
+        if self.samples is not None:
+            self.position = position
+        else:
+            self.file.seek(position)
+        if self.resampler is not None:
+            # whatever the stream was holding back belongs to the old position
+            self.resampler = self.create_resampler()
+        self.done = False
+
+    def read_file(self, frames):
+        if self.samples is not None:
+            block = self.samples[self.position: self.position + frames]
+            self.position += len(block)
+            if block.dtype != np.float32 or self.scale != 1.0:
+                block = block.astype('f4') * np.float32(self.scale)
+        else:
+            block = self.file.read(frames, dtype='float32', always_2d=True)
+
+        if self.channels is not None:
+            if self.channels >= block.shape[1]:
+                # repeat the file's channels to fill the extra ones
+                return block[:, np.arange(self.channels) % block.shape[1]]
+            # or average every file channel into the output channel it would have been repeated as
+            return np.stack([block[:, c::self.channels].mean(axis=1, dtype='f4') for c in range(self.channels)], axis=1)
+
+        # mix down to mono the same way librosa.load does
+        if block.shape[1] == 1:
+            return block[:, 0]
+        return block.mean(axis=1, dtype='f4')
+
+    def read(self, frames):
+        block = self.read_file(frames)
+        last = len(block) < frames
+        if self.resampler is not None:
+            block = self.resampler.resample_chunk(np.ascontiguousarray(block), last=last)
+        self.done = last
+        return block if self.channels is None else block.T
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def decode_span(file_name, start, length, rate=None, channels=None):
+    """
+    Up to length samples of a file from the given frame on, decoded on their own rather than by seeking
+    the decoder that playback uses.
+    """
+    decoder = Decoder(file_name, rate=rate, channels=channels)
+    decoder.seek(start)
+    blocks = []
+    count = 0
+    while count < length and not decoder.done:
+        # a resampler holds some samples back, so read in blocks until enough have come out
+        block = decoder.read(max(math.ceil((length - count) * decoder.file_rate / decoder.rate), BUFFER_SIZE))
+        blocks.append(block)
+        count += block.shape[-1]
+    decoder.close()
+
+    if not blocks:
+        return np.zeros((channels, 0) if channels else (0,), dtype='f4')
+    return np.concatenate(blocks, axis=-1)[..., :length]
+
+
+class ReadAhead(threading.Thread):
+    """
+    Keeps a bounded buffer of decoded samples ahead of playback on a background thread.
+
+    read() never blocks, so it is safe to call from the PyAudio callback. seek() and loop move where
+    decoding carries on from, and it is the decoding thread that acts on them, so the decoder is only
+    ever used by one thread. A short lock keeps the consumer from reading while a seek empties the buffer.
+    """
+
+    def __init__(self, decoder, capacity=READ_AHEAD, block=BUFFER_SIZE * 8):
+        super().__init__(daemon=True)
+        self.decoder = decoder
+        self.block = block
+        self.ring = RingBuffer(capacity, channels=decoder.channels)
+        self.position = 0           # next sample handed to the consumer
+        self.played = 0             # frame of the file that sample came from
+        self.frame = 0              # frame of the file the next decoded sample comes from
+        self.jumps = collections.deque()    # (ring position, frame) wherever decoding went back to the loop start
+        self.target = None          # frame a seek asked for, until the decoding thread has moved there
+        self.loop = None            # (start, end) frames to play over and over
+        self.peak = 0.0             # peak amplitude of everything decoded so far
+        self.finished = False       # decoded up to the end of the file
+        self.running = True
+        self.lock = threading.Lock()
+        self.primed = threading.Event()
+        self.space = threading.Event()
+
+    def run(self):
+        while self.running:
+            if self.target is not None:
+                self.reposition()
+
+            loop = self.loop
+            if loop is not None and (self.frame >= loop[1] or self.decoder.done):
+                # straight on from the end of the loop to its start, without a gap
+                self.decoder.seek(loop[0])
+                self.frame = loop[0]
+                self.jumps.append((self.ring.total, loop[0]))
+
+            if self.decoder.done:
+                if not self.finished:
+                    self.finished = True
+                    logger.info(f"decoding finished, {self.ring.total} samples, peak {self.peak:.3f}")
+                self.primed.set()
+                self.wait()
+                continue
+
+            if self.ring.total - self.position + self.block > self.ring.capacity:
+                self.primed.set()
+                self.wait()
+                continue
+
+            count = self.block if loop is None else min(self.block, loop[1] - self.frame)
+            data = self.decoder.read(count)
+            if data.shape[-1]:
+                self.peak = max(self.peak, float(np.abs(data).max()))
+                self.ring.write(data)
+                self.frame += data.shape[-1]
+
+        self.decoder.close()
+
+    def wait(self):
+        self.space.wait(0.1)
+        self.space.clear()
+
+    def reposition(self):
+        # everything decoded so far is dropped, the consumer carries on from the new frame
+        with self.lock:
+            self.decoder.seek(self.target)
+            self.frame = self.played = self.target
+            self.position = self.ring.total
+            self.jumps.clear()
+            self.target = None
+
+    def seek(self, frame):
+        with self.lock:
+            self.target = frame
+            self.finished = False
+        self.space.set()
+
+    @property
+    def exhausted(self):
+        return self.finished and self.position >= self.ring.total
+
+    def read(self, count):
+        """
+        Up to count samples, with the (offset, frame) pairs of where in the file the first of them and
+        any after a jump back to the loop start came from.
+        """
+        with self.lock:
+            # nothing from before a seek should be heard after it
+            count = 0 if self.target is not None else min(count, self.ring.total - self.position)
+            # copy, the slot is free for the decoder as soon as the position moves past it
+            data = self.ring.read(self.position, count).copy()
+            marks = [(0, self.played)]
+            while self.jumps and self.jumps[0][0] < self.position + count:
+                position, frame = self.jumps.popleft()
+                marks.append((position - self.position, frame))
+            offset, frame = marks[-1]
+            self.played = frame + count - offset
+            self.position += count
+        self.space.set()
+        return data, marks
+
+    def stop(self):
+        self.running = False
+        self.space.set()
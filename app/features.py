@@ -0,0 +1,115 @@
+import numpy as np
+import threading
+from config import SAMPLE_RATE, FEATURE_HISTORY, ONSET_THRESHOLD, ONSET_FLOOR, ONSET_WINDOW
+from ring import RingBuffer
+
+
+# one row per channel and hop
+FEATURE_DTYPE = np.dtype([
+    ('hop', '<i8'),         # hop number in the file, -1 where the source can't tell
+    ('peak', '<f4'),        # frequency of the strongest bin, Hz
+    ('centroid', '<f4'),    # magnitude weighted mean frequency, Hz
+    ('flux', '<f4'),        # rise in magnitude since the previous hop, summed over the bins
+    ('rms', '<f4'),         # level of the samples the hop moved on by
+    ('onset', '?'),         # flux jumped well above its recent average
+])
+
+
+class Features:
+    """
+    Per hop spectral features, worked out from the magnitudes the spectrogram's STFT has already
+    produced, so the analysis runs once for both.
+
+    Every reduction covers a whole batch of hops at once. The last hop's magnitudes and the recent flux
+    are carried over between batches, so flux and onsets come out the same however the hops are batched.
+    The newest FEATURE_HISTORY rows are kept as a (channels, hops) FEATURE_DTYPE array for whoever wants
+    them, and every batch is also handed to the listeners as it is computed. The analysis thread writes
+    that array while the render loop reads it, so both hold the lock.
+    """
+
+    def __init__(self, analysis, rate=SAMPLE_RATE, channels=1, capacity=FEATURE_HISTORY,
+                 threshold=ONSET_THRESHOLD, floor=ONSET_FLOOR, window=ONSET_WINDOW):
+        self.rate = rate
+        self.channels = channels
+        self.threshold = threshold
+        self.floor = floor
+        self.window = window
+        self.ring = RingBuffer(capacity, dtype=FEATURE_DTYPE, channels=channels)
+        self.lock = threading.Lock()
+        self.listeners = []     # called with every (channels, N) batch, on the analysis thread
+        self.configure(analysis)
+
+    def configure(self, analysis):
+        self.analysis = analysis
+        self.frequencies = np.fft.rfftfreq(analysis.window_size, 1 / self.rate).astype('f4')
+        # sums over the bins as matrix products, which numpy does a lot faster than sum()
+        self.moments = np.stack((np.ones_like(self.frequencies), self.frequencies), axis=1)
+        # magnitudes of a full scale sine come out at half the sum of the taper, this makes them amplitudes
+        self.norm = 2 / analysis.taper.sum()
+        self.reset()
+
+    def reset(self):
+        # the next hop doesn't follow on from the last one, e.g. after a seek
+        self.previous = None
+        self.recent = np.zeros((self.channels, self.window), dtype='f4')
+        self.was_onset = np.zeros(self.channels, dtype=bool)
+        self.next_hop = None
+
+    def add(self, magnitudes, windows, hops=None):
+        """
+        Features of a (channels, N, bins) batch of magnitudes and the (channels, N, window_size) windows they
+        came from. hops is the range of their hop numbers, if known.
+        """
+        count = magnitudes.shape[1]
+        if count == 0:
+            return None
+        if hops is not None and self.next_hop is not None and hops.start != self.next_hop:
+            self.reset()
+        self.next_hop = hops.stop if hops is not None else None
+
+        features = np.empty((self.channels, count), dtype=FEATURE_DTYPE)
+        features['hop'] = hops if hops is not None else -1
+        features['peak'] = self.frequencies[magnitudes.argmax(axis=-1)]
+        moments = magnitudes @ self.moments
+        features['centroid'] = moments[..., 1] / np.maximum(moments[..., 0], 1e-12)
+
+        # same samples per hop as the wave's envelope, so consecutive hops cover each sample once
+        hop_samples = windows[..., :self.analysis.hop_size]
+        features['rms'] = np.sqrt(np.einsum('...i,...i->...', hop_samples, hop_samples) / hop_samples.shape[-1])
+
+        # positive flux against the hop before, the first hop of all has nothing to compare with
+        rises = np.empty_like(magnitudes)
+        rises[:, 0] = 0 if self.previous is None else magnitudes[:, 0] - self.previous
+        np.subtract(magnitudes[:, 1:], magnitudes[:, :-1], out=rises[:, 1:])
+        np.maximum(rises, 0, out=rises)
+        flux = (rises @ self.moments[:, 0]) * self.norm
+        features['flux'] = flux
+        self.previous = magnitudes[:, -1].copy()
+
+        # onset where the flux is threshold times its average over the hops before, and the hop before wasn't one
+        history = np.concatenate((self.recent, flux), axis=1)
+        sums = np.cumsum(np.pad(history, ((0, 0), (1, 0))), axis=1)
+        average = (sums[:, self.window: -1] - sums[:, :-self.window - 1]) / self.window
+        above = flux > np.maximum(self.threshold * average, self.floor)
+        before = np.concatenate((self.was_onset[:, np.newaxis], above[:, :-1]), axis=1)
+        features['onset'] = above & ~before
+        self.recent = history[:, -self.window:]
+        self.was_onset = above[:, -1]
+
+        with self.lock:
+            self.ring.write(features)
+        for listener in self.listeners:
+            listener(features)
+        return features
+
+    def latest(self, count):
+        # the newest count rows of every channel, oldest first
+        with self.lock:
+            count = min(count, self.ring.total, self.ring.capacity)
+            return self.ring.read(self.ring.total - count, count).copy()
+
+    def since(self, total):
+        # the rows written since the ring held total of them, as many as are still kept, and the new total
+        with self.lock:
+            count = min(self.ring.total - total, self.ring.capacity)
+            return self.ring.read(self.ring.total - count, count).copy(), self.ring.total
@@ -0,0 +1,126 @@
+"""
+Render the live view of an audio file without a display, as fast as the machine allows.
+
+The scene runs in a standalone OpenGL context on a virtual clock, so every frame sees exactly the audio
+that would have played by then. Frames are written as raw RGB24 to a file or pipe, or as a PNG sequence.
+
+Usage:
+    python headless.py in.wav - --fps 60 | ffmpeg -f rawvideo -pix_fmt rgb24 -s 1600x900 -r 60 -i - out.mp4
+    python headless.py in.wav frames/ --format png
+"""
+import argparse
+import moderngl
+import numpy as np
+import os
+import sys
+import time
+from config import WINDOW_WIDTH, WINDOW_HEIGHT
+from scene import Scene
+from source import ArraySource
+from utils import logger
+
+
+def create_context():
+    try:
+        ctx = moderngl.create_standalone_context(require=330)
+    except Exception:
+        # no X display, go straight to EGL which works on headless machines
+        ctx = moderngl.create_standalone_context(require=330, backend="egl")
+
+    # the same state Window.initializeGL sets up
+    ctx.enable(moderngl.BLEND)
+    return ctx
+
+
+class Headless(Scene):
+    """
+    Drives Scene.init, win_size and draw against an offscreen framebuffer instead of a Qt window.
+
+    Readback is double buffered: each frame is copied into one of two pixel buffers without waiting,
+    and only the previous frame's buffer is read back, by which time its copy has long finished. So the
+    GPU renders frame n while the CPU collects frame n - 1.
+    """
+
+    # the DSP runs on this thread, so what is on screen is a function of the clock alone
+    threaded = False
+
+    def __init__(self, ctx, file_name, width=WINDOW_WIDTH, height=WINDOW_HEIGHT):
+        super().__init__()
+        self.ctx = ctx
+        self.file_name = file_name
+        self.width = width
+        self.height = height
+        self.fbo = ctx.simple_framebuffer((width, height))
+        self.readback = [ctx.buffer(reserve=width * height * 3) for _ in range(2)]
+
+    def create_source(self):
+        return ArraySource(self.file_name)
+
+    def frames(self, fps=60, max_frames=None, start=0.0):
+        """
+        Yield every frame as a (height, width, 3) uint8 array, top row first, from start seconds into the
+        file until it has finished playing or max_frames have been rendered.
+        """
+        self.init()
+        self.win_size(self.width, self.height)
+        if start:
+            self.seek(start)
+
+        dt = 1 / fps
+        count = 0
+        while max_frames is None or count < max_frames:
+            self.source.advance(dt)
+            if self.source.complete and self.source.available() == 0:
+                break
+
+            self.fbo.use()
+            self.fbo.clear()
+            self.draw(dt)
+            self.fbo.read_into(self.readback[count % 2], components=3)
+            if count:
+                yield self.frame(count - 1)
+            count += 1
+
+        if count:
+            yield self.frame(count - 1)
+
+    def frame(self, index):
+        pixels = np.frombuffer(self.readback[index % 2].read(), dtype='u1')
+        # OpenGL rows start at the bottom
+        return pixels.reshape(self.height, self.width, 3)[::-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("in_file")
+    parser.add_argument("out", help="file or pipe for raw frames, - for stdout, or a directory for png")
+    parser.add_argument("--format", choices=("raw", "png"), default="raw")
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--frames", type=int, help="stop after this many frames")
+    parser.add_argument("--start", type=float, default=0.0, help="seconds into the file to start from")
+    args = parser.parse_args()
+
+    scene = Headless(create_context(), args.in_file)
+    if args.format == "png":
+        from PIL import Image
+        os.makedirs(args.out, exist_ok=True)
+    else:
+        out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+
+    start = time.perf_counter()
+    count = 0
+    for count, frame in enumerate(scene.frames(args.fps, args.frames, args.start), 1):
+        if args.format == "png":
+            Image.fromarray(frame).save(os.path.join(args.out, f"frame-{count:06}.png"))
+        else:
+            out.write(np.ascontiguousarray(frame).data)
+    scene.exit()
+    if args.format == "raw" and args.out != "-":
+        out.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"{count} frames in {elapsed:.2f}s, {count / args.fps / elapsed:.1f}x real time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import json
+import numpy as np
+import os
+from config import HISTORY_LEVELS, HISTORY_CHUNK, HISTORY_RANGE
+
+
+class Level:
+    """
+    One zoom level, a (columns, bins) uint8 array in a memory mapped file that grows a chunk at a time.
+    """
+
+    def __init__(self, file_name, bins, chunk=HISTORY_CHUNK):
+        self.file_name = file_name
+        self.bins = bins
+        self.chunk = chunk
+        self.count = 0
+        self.data = np.zeros((0, bins), dtype='u1')
+        open(file_name, 'wb').close()
+
+    def append(self, columns):
+        end = self.count + len(columns)
+        if end > len(self.data):
+            # grow the file and map it again, the old pages stay in the page cache rather than our heap
+            capacity = -(-end // self.chunk) * self.chunk
+            with open(self.file_name, 'r+b') as f:
+                f.truncate(capacity * self.bins)
+            self.data = np.memmap(self.file_name, dtype='u1', mode='r+', shape=(capacity, self.bins))
+        self.data[self.count: end] = columns
+        self.count = end
+
+    def read(self, start, end):
+        return self.data[max(0, start): min(end, self.count)]
+
+    def close(self):
+        # write out what is still only in the page cache and cut the file down to the columns in it
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+        self.data = np.zeros((0, self.bins), dtype='u1')
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(self.count * self.bins)
+
+
+class History:
+    """
+    Append only store of quantised spectrogram columns with a zoom pyramid, so hours of capture can be
+    scrolled through and zoomed out of.
+
+    Every channel of a column is stored side by side. Level 0 holds every column and level k the max
+    over each 2 ** k of them. The levels are built incrementally as columns arrive, with at most one
+    column per level waiting for its pair, so memory stays flat however long it runs. Each level is a
+    single memory mapped file, so any span of any level is a single slice read.
+    """
+
+    def __init__(self, path, bins, hop_rate, levels=HISTORY_LEVELS, db_range=HISTORY_RANGE, channels=1):
+        os.makedirs(path, exist_ok=True)
+        self.bins = bins
+        self.channels = channels
+        self.min_db, self.max_db = db_range
+        self.levels = [Level(os.path.join(path, f"level{k}.u1"), bins * channels) for k in range(levels)]
+        self.carry = [np.zeros((0, bins * channels), dtype='u1') for _ in range(levels)]
+
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            meta = {"bins": bins, "channels": channels, "hop_rate": hop_rate, "levels": levels, "db_range": db_range}
+            json.dump(meta, f)
+
+    def quantise(self, levels):
+        scaled = (levels - self.min_db) * (255 / (self.max_db - self.min_db))
+        return np.clip(scaled + 0.5, 0, 255).astype('u1')
+
+    def dequantise(self, columns):
+        return columns.astype('f4') * ((self.max_db - self.min_db) / 255) + self.min_db
+
+    def append(self, levels):
+        # (channels, N, bins) dB levels
+        columns = self.quantise(levels).transpose(1, 0, 2).reshape(levels.shape[1], -1)
+        for k, level in enumerate(self.levels):
+            level.append(columns)
+            if k + 1 == len(self.levels):
+                break
+
+            # pair up with the column left over from last time, and carry any odd one out to the next call
+            columns = np.concatenate((self.carry[k], columns))
+            pairs = len(columns) // 2
+            self.carry[k] = columns[pairs * 2:]
+            columns = np.maximum(columns[0: pairs * 2: 2], columns[1: pairs * 2: 2])
+            if pairs == 0:
+                break
+
+    def close(self):
+        # the columns still carried over to the coarser levels are dropped, there is nothing to pair them with
+        for level in self.levels:
+            level.close()
+
+    def length(self, level):
+        return self.levels[level].count
+
+    def view(self, level, end=None, width=1):
+        """
+        (channels, N, bins) dB levels of up to width columns of the zoom level, ending just before column end
+        (default newest).
+        """
+        data = self.levels[level]
+        end = data.count if end is None else end
+        columns = data.read(end - width, end)
+        return self.dequantise(columns.reshape(len(columns), self.channels, self.bins).transpose(1, 0, 2))
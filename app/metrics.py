@@ -0,0 +1,139 @@
+import json
+import numpy as np
+import threading
+import time
+from config import METRICS, METRICS_DUMP, METRICS_DUMP_INTERVAL, METRICS_HISTORY
+
+
+class Histogram:
+    """
+    Rolling window over the most recent samples of one measurement.
+    """
+
+    def __init__(self, size=METRICS_HISTORY):
+        self.values = np.zeros(size)
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def summary(self):
+        values = self.values[:min(self.count, len(self.values))]
+        if len(values) == 0:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            "count": self.count,
+            "mean": float(values.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(values.max()),
+        }
+
+
+class Timer:
+
+    def __init__(self, metrics, name, items=1):
+        self.metrics = metrics
+        self.name = name
+        self.items = items
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.items:
+            self.metrics.record(self.name, (time.perf_counter() - self.start) / self.items)
+
+
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    """
+    Rolling stage timings, counters and gauges for the render loop.
+
+    Every method returns straight away while disabled, and timer() hands back a shared no-op
+    context manager, so leaving the calls in the hot path costs next to nothing.
+
+    The audio callback and the analysis worker record from their own threads, so adding a name and
+    taking a snapshot are done under a lock. Adding to an existing histogram isn't, that stays lock free.
+    """
+
+    def __init__(self, enabled=METRICS, dump_path=METRICS_DUMP, dump_interval=METRICS_DUMP_INTERVAL):
+        self.enabled = enabled
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.last_dump = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, value):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        histogram.add(value)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        if self.enabled:
+            with self.lock:
+                self.gauges[name] = value
+
+    def timer(self, name, items=1):
+        """
+        Time a block into the named histogram, divided by items to get a per item time.
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, items)
+
+    def snapshot(self):
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        return {
+            "time": time.time(),
+            "histograms": {name: histogram.summary() for name, histogram in histograms},
+            "counters": counters,
+            "gauges": gauges,
+        }
+
+    def dump(self, path=None):
+        with open(path or self.dump_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def tick(self):
+        # called once a frame, writes the periodic dump when one is configured
+        if not self.enabled or not self.dump_path:
+            return
+        now = time.time()
+        if now - self.last_dump >= self.dump_interval:
+            self.last_dump = now
+            self.dump()
+
+
+metrics = Metrics()
@@ -0,0 +1,88 @@
+import numpy as np
+import time
+from metrics import metrics
+from text import Text
+
+
+class MetricsOverlay:
+    """
+    Shows the headline metrics as text in a corner of the window, refreshed a couple of times a second.
+    """
+
+    # (histogram, label, scale, unit)
+    rows = [
+        ("frame_interval", "frame", 1000, "ms"),
+        ("dsp_per_hop", "dsp/hop", 1000, "ms"),
+        ("upload", "upload", 1000, "ms"),
+        ("source_backlog", "backlog", 1, "hops"),
+    ]
+
+    def __init__(self, ctx, x, y, interval=0.5, line_height=16):
+        self.text = Text(ctx)
+        self.interval = interval
+        self.updated = 0.0
+        self.labels = [self.text.add("", x, y + i * line_height) for i in range(len(self.rows) + 1)]
+
+    def refresh(self):
+        snapshot = metrics.snapshot()
+        histograms = snapshot["histograms"]
+        for label, (name, title, scale, unit) in zip(self.labels, self.rows):
+            summary = histograms.get(name, {"count": 0})
+            if summary["count"]:
+                line = f"{title} p50 {summary['p50'] * scale:.2f} p99 {summary['p99'] * scale:.2f} {unit}"
+            else:
+                line = f"{title} -"
+            self.text.set_text(label, line)
+
+        # overflow, underrun and drop counts, only once they are non-zero
+        counters = {**snapshot["counters"], **snapshot["gauges"]}
+        drops = " ".join(f"{name} {value}" for name, value in sorted(counters.items()) if value and "bytes" not in name)
+        self.text.set_text(self.labels[-1], drops)
+
+    def size(self, w, h):
+        self.text.size(w, h)
+
+    def draw(self):
+        now = time.time()
+        if now - self.updated >= self.interval:
+            self.updated = now
+            self.refresh()
+        self.text.draw()
+
+
+class FeatureOverlay:
+    """
+    Shows the newest spectral features of every channel as text, along with how many onsets there were
+    since the last refresh.
+    """
+
+    def __init__(self, ctx, x, y, features, interval=0.25, line_height=16):
+        self.text = Text(ctx)
+        self.features = features
+        self.interval = interval
+        self.updated = 0.0
+        self.seen = 0           # features.ring.total at the last refresh
+        self.labels = [self.text.add("", x, y + i * line_height) for i in range(features.channels)]
+
+    def refresh(self):
+        rows, self.seen = self.features.since(self.seen)
+        if rows.shape[1] == 0:
+            return
+
+        onsets = rows['onset'].sum(axis=1)
+        for channel, label in enumerate(self.labels):
+            row = rows[channel, -1]
+            rms_db = 20 * np.log10(max(float(row['rms']), 1e-5))
+            line = (f"peak {row['peak']:.0f} Hz  centroid {row['centroid']:.0f} Hz  rms {rms_db:.1f} dB  "
+                    f"flux {row['flux']:.3f}  onsets {onsets[channel]}")
+            self.text.set_text(label, line)
+
+    def size(self, w, h):
+        self.text.size(w, h)
+
+    def draw(self):
+        now = time.time()
+        if now - self.updated >= self.interval:
+            self.updated = now
+            self.refresh()
+        self.text.draw()
@@ -0,0 +1,92 @@
+import collections
+import numpy as np
+import threading
+import time
+from config import ANALYSIS_QUEUE
+from metrics import metrics
+from utils import logger
+from wave import Wave
+
+
+class Analyser(threading.Thread):
+    """
+    Pulls windows from the source and runs the STFT, colour and envelope steps on a worker thread.
+
+    Finished hops go into a bounded single producer, single consumer queue. The worker only ever appends
+    to it and the render thread only ever pops from it, and each side owns one of the two counters the
+    depth is derived from, so neither side takes a lock. The render thread is left with the uploads.
+    """
+
+    def __init__(self, source, spectrogram, capacity=ANALYSIS_QUEUE, poll=None):
+        super().__init__(daemon=True)
+        self.source = source
+        self.spectrogram = spectrogram
+        self.capacity = capacity
+        self.poll = poll or source.analysis.hop_size / source.rate / 2     # half a hop
+        self.queue = collections.deque()
+        self.produced = 0           # hops pushed, only written by the worker
+        self.consumed = 0           # hops taken or skipped, only written by the render thread
+        self.running = True
+        self.busy = 0.0
+        self.started = time.perf_counter()
+
+    @property
+    def depth(self):
+        return self.produced - self.consumed
+
+    @property
+    def utilisation(self):
+        # fraction of wall time the worker spent analysing rather than waiting
+        return self.busy / max(time.perf_counter() - self.started, 1e-9)
+
+    def run(self):
+        while self.running:
+            count = min(self.source.available(), self.capacity - self.depth)
+            if count <= 0:
+                time.sleep(self.poll)
+                continue
+
+            start = time.perf_counter()
+            windows = self.source.get_many(count)
+            columns = self.spectrogram.analyse(windows, self.source.hops, self.source.gain)
+            samples = Wave.envelope(windows, self.source.analysis.hop_size)
+            self.queue.append((columns, samples))
+            self.produced += windows.shape[1]
+
+            elapsed = time.perf_counter() - start
+            self.busy += elapsed
+            metrics.record("dsp_per_hop", elapsed / windows.shape[1])
+
+        logger.info("analyser stopped")
+
+    def take(self, count):
+        """
+        Pop up to count analysed hops, returned as (columns, samples) arrays with hops along axis 1.
+        """
+        columns, samples = [], []
+        while count > 0 and self.queue:
+            batch_columns, batch_samples = self.queue.popleft()
+            hops = batch_columns.shape[1]
+            if hops > count:
+                # put the rest back at the head, the worker only ever touches the tail
+                self.queue.appendleft((batch_columns[:, count:], batch_samples[:, count:]))
+                batch_columns, batch_samples = batch_columns[:, :count], batch_samples[:, :count]
+                hops = count
+            columns.append(batch_columns)
+            samples.append(batch_samples)
+            count -= hops
+            self.consumed += hops
+
+        if not columns:
+            return None, None
+        return np.concatenate(columns, axis=1), np.concatenate(samples, axis=1)
+
+    def skip(self, count):
+        self.take(count)
+
+    def report(self):
+        metrics.gauge("analysis_queue_depth", self.depth)
+        metrics.gauge("analysis_utilisation", round(self.utilisation, 3))
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,200 @@
+import collections
+import numpy as np
+import os
+import struct
+import threading
+import time
+from config import SAMPLE_RATE, HOP_SIZE, RECORD_QUEUE, RECORD_MAX_BYTES, RECORD_MAX_SECONDS
+from metrics import metrics
+from utils import logger
+
+
+# every .npy header is padded to this many bytes, so it can be rewritten in place with the final shape
+NPY_HEADER_SIZE = 128
+
+
+class ChunkWriter:
+    """
+    Writes a stream of blocks into numbered files, moving on to the next file once the current one
+    holds max_bytes or max_frames. Each file is readable even if the app dies before it is closed.
+    """
+
+    suffix = None
+
+    def __init__(self, path, name, max_bytes, max_frames):
+        self.path = path
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.number = 0
+        self.file = None
+        self.frames = 0
+        self.bytes = 0
+        self.shape = None
+
+    def header(self, frames):
+        raise NotImplementedError("writer.header")
+
+    def write(self, data):
+        # data is (frames, ...), a file is closed early if anything after the first axis changes
+        if self.file is not None and data.shape[1:] != self.shape:
+            self.close()
+        if self.file is None:
+            self.number += 1
+            self.shape = data.shape[1:]
+            self.dtype = data.dtype
+            self.frames = 0
+            self.bytes = 0
+            file_name = os.path.join(self.path, f"{self.name}-{self.number:04}{self.suffix}")
+            self.file = open(file_name, 'wb')
+            self.file.write(self.header(None))
+
+        data = np.ascontiguousarray(data)
+        self.file.write(data.data)
+        self.frames += len(data)
+        self.bytes += data.nbytes
+        if self.bytes >= self.max_bytes or self.frames >= self.max_frames:
+            self.close()
+        return data.nbytes
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.seek(0)
+        self.file.write(self.header(self.frames))
+        self.file.close()
+        self.file = None
+
+
+class WavWriter(ChunkWriter):
+    # (frames, channels) float32 samples, as an IEEE float WAV
+
+    suffix = ".wav"
+
+    def __init__(self, path, name, max_bytes, max_frames, rate):
+        super().__init__(path, name, max_bytes, max_frames)
+        self.rate = rate
+
+    def header(self, frames):
+        channels = self.shape[0]
+        block = channels * 4
+        # sizes are left at the maximum until the file is closed, which wav_memmap clamps to the file size
+        size = 0xFFFFFFFF if frames is None else frames * block
+        riff = 0xFFFFFFFF if frames is None else size + 50
+        # anything but PCM has the extended fmt chunk, with no extra bytes, and a fact chunk with the frame count
+        return struct.pack(
+            '<4sI4s4sIHHIIHHH4sII4sI',
+            b'RIFF', riff, b'WAVE',
+            b'fmt ', 18, 3, channels, self.rate, self.rate * block, block, 32, 0,
+            b'fact', 4, 0xFFFFFFFF if frames is None else frames,
+            b'data', size,
+        )
+
+
+class NpyWriter(ChunkWriter):
+    # (frames, ...) arrays of any dtype, as a .npy file
+
+    suffix = ".npy"
+
+    def header(self, frames):
+        # a crash leaves the shape at 0 frames, but the columns are all there after the header
+        shape = (frames or 0,) + self.shape
+        header = f"{{'descr': '{np.lib.format.dtype_to_descr(self.dtype)}', 'fortran_order': False, 'shape': {shape}, }}"
+        header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class BlockQueue:
+    # bounded single producer, single consumer queue, each side only writes its own counter
+
+    def __init__(self, writer, capacity):
+        self.writer = writer
+        self.capacity = capacity
+        self.blocks = collections.deque()
+        self.added = 0
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def depth(self):
+        return self.added - self.written
+
+    def add(self, data):
+        if self.depth >= self.capacity:
+            self.dropped += 1
+            return
+        self.blocks.append(data)
+        self.added += 1
+
+
+class Recorder(threading.Thread):
+    """
+    Streams captured samples, and optionally the spectrogram columns, to disk on a background thread.
+
+    The audio callback and the analysis step only append to bounded queues and never touch the disk.
+    When a queue is full the block is dropped and counted rather than blocking the caller. Like the
+    Analyser queue, each deque has a single producer and a single consumer, so no locks are taken.
+    """
+
+    def __init__(self, path, rate=SAMPLE_RATE, columns=False, capacity=RECORD_QUEUE,
+                 max_bytes=RECORD_MAX_BYTES, max_seconds=RECORD_MAX_SECONDS, poll=0.05, hop_size=HOP_SIZE):
+        super().__init__(daemon=True)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.poll = poll
+        self.running = True
+        self.rate = rate
+        self.max_seconds = max_seconds
+
+        self.samples = WavWriter(path, "audio", max_bytes, max_seconds * rate, rate)
+        self.columns = NpyWriter(path, "columns", max_bytes, max_seconds * rate // hop_size) if columns else None
+        self.sample_queue = BlockQueue(self.samples, capacity)
+        self.column_queue = BlockQueue(self.columns, capacity) if columns else None
+        self.queues = [queue for queue in (self.sample_queue, self.column_queue) if queue]
+        self.written = 0
+
+    def configure(self, analysis):
+        # a column per hop, so the hop decides how many of them make up max_seconds
+        if self.columns is not None:
+            self.columns.max_frames = self.max_seconds * self.rate // analysis.hop_size
+
+    def add_samples(self, samples):
+        # (channels, frames) samples, the array must not be modified afterwards
+        self.sample_queue.add(samples.T)
+
+    def add_columns(self, levels):
+        # (channels, N, bins) dB levels
+        if self.column_queue is not None:
+            self.column_queue.add(levels.transpose(1, 0, 2).astype('f4'))
+
+    def run(self):
+        logger.info(f"recording to {self.path}")
+        while True:
+            idle = True
+            for queue in self.queues:
+                while queue.blocks:
+                    self.written += queue.writer.write(queue.blocks.popleft())
+                    queue.written += 1
+                    idle = False
+
+            if idle:
+                if not self.running:
+                    break
+                time.sleep(self.poll)
+
+        for queue in self.queues:
+            queue.writer.close()
+        logger.info(f"recording stopped, {self.written} bytes written")
+
+    @property
+    def dropped(self):
+        return sum(queue.dropped for queue in self.queues)
+
+    def report(self):
+        metrics.gauge("record_bytes", self.written)
+        metrics.gauge("record_queue_depth", max(queue.depth for queue in self.queues))
+        metrics.gauge("record_dropped_blocks", self.dropped)
+
+    def stop(self):
+        # whatever is still queued is written out before the thread ends
+        self.running = False
@@ -1,5 +1,6 @@
+import moderngl
 import numpy as np
-from utils import orthographic
+from utils import orthographic, program
 
 
 class Rect:
@@ -26,17 +27,16 @@ void main() {
 }
 """
 
+    mode = moderngl.TRIANGLES
+
     def __init__(self, ctx, x, y, w, h, colour=(0.0, 0.5, 1.0, 1.0)):
         self.ctx = ctx
         self.x = x
         self.y = y
         self.w = w
         self.h = h
-        self.prog = self.ctx.program(
-            vertex_shader=self.vert_shader,
-            fragment_shader=self.frag_shader,
-        )
-        self.prog['colour'] = colour
+        self.colour = colour
+        self.prog = program(self.ctx, self.vert_shader, self.frag_shader)
 
         vertices = np.array([
             x, y,
@@ -47,13 +47,16 @@ void main() {
             x, y + h,
         ])
 
-        vertices = vertices.astype('f4')
-        buffer = self.ctx.buffer(vertices)
-        self.vao = self.ctx.vertex_array(self.prog, buffer, 'vertex')
+        self.vertices = vertices.astype('f4')
+        self.vao = None     # only created when drawn on its own rather than as part of Shapes
 
     def size(self, w, h):
         projection = orthographic(w, h)
         self.prog['projection'].write(projection)
 
     def draw(self):
-        self.vao.render()
+        if self.vao is None:
+            buffer = self.ctx.buffer(self.vertices)
+            self.vao = self.ctx.vertex_array(self.prog, buffer, 'vertex')
+        self.prog['colour'] = self.colour
+        self.vao.render(self.mode)
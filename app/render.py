@@ -0,0 +1,75 @@
+"""
+Render a whole audio file to a spectrogram image as fast as possible, without Qt, PyAudio or OpenGL.
+
+Usage: python render.py in.wav out.png [--min-db DB] [--max-db DB]
+"""
+import argparse
+import numpy as np
+import time
+from PIL import Image
+from config import WINDOW_SIZE, HOP_SIZE, SAMPLE_RATE, NATIVE_RATE
+from decode import Decoder
+from spectrogram import stft_slice, stft_colour
+from utils import logger
+
+
+# hops pushed through the STFT at once, which bounds the working memory of the render
+CHUNK_HOPS = 4096
+
+
+def render_columns(decoder, min_db=-25, max_db=30):
+    """
+    Yield (N, WINDOW_SIZE // 2 + 1, 3) blocks of colour columns for the whole file.
+
+    Hops line up with Source.get, one window every HOP_SIZE samples for as long as a full window is left.
+    """
+    block = (CHUNK_HOPS - 1) * HOP_SIZE + WINDOW_SIZE
+    pending = np.zeros(0, dtype='f4')
+    while not decoder.done:
+        pending = np.concatenate((pending, decoder.read(block)))
+        hops = (len(pending) - WINDOW_SIZE) // HOP_SIZE + 1
+        if hops <= 0:
+            continue
+
+        windows = np.lib.stride_tricks.sliding_window_view(pending, WINDOW_SIZE)[:hops * HOP_SIZE:HOP_SIZE]
+        yield stft_colour(stft_slice(windows), min_db, max_db)
+        pending = pending[hops * HOP_SIZE:]
+
+
+def render(in_file, out_file, min_db=-25, max_db=30):
+    start = time.perf_counter()
+    decoder = Decoder(in_file, rate=None if NATIVE_RATE else SAMPLE_RATE)
+    hops = (decoder.frames - WINDOW_SIZE) // HOP_SIZE + 1
+    if hops <= 0:
+        raise ValueError(f"{in_file} is shorter than one window")
+
+    # the image is the only thing the size of the file, each block of columns goes straight into it,
+    # high frequencies at the top and time running left to right, just like the live view
+    image = np.zeros((WINDOW_SIZE // 2 + 1, hops, 3), dtype='u1')
+    count = 0
+    for columns in render_columns(decoder, min_db, max_db):
+        # a resampled file can come out a few samples off the length worked out up front
+        columns = columns[:hops - count]
+        image[:, count: count + len(columns)] = columns.transpose(1, 0, 2)[::-1]
+        count += len(columns)
+    decoder.close()
+
+    Image.fromarray(image[:, :count]).save(out_file)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"rendered {count} hops at {decoder.rate} Hz from {in_file} to {out_file} in {elapsed:.2f}s")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("in_file")
+    parser.add_argument("out_file")
+    parser.add_argument("--min-db", type=float, default=-25)
+    parser.add_argument("--max-db", type=float, default=30)
+    args = parser.parse_args()
+    render(args.in_file, args.out_file, args.min_db, args.max_db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import functools
+import math
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def polyphase_filter(up, down, taps=32):
+    """
+    Kaiser windowed sinc low pass for resampling by up / down, split into its up phases.
+
+    Returns an (up, taps) array whose row p holds the taps of phase p, reversed so each row can be
+    dotted straight with taps consecutive input samples, oldest first.
+    """
+    length = up * taps
+    cutoff = 1 / max(up, down)      # relative to the upsampled Nyquist
+    t = np.arange(length) - (length - 1) / 2
+    h = cutoff * np.sinc(cutoff * t) * np.kaiser(length, 8.0)
+    h *= up / h.sum()               # unity gain once the zeros that upsampling inserts are accounted for
+    return np.ascontiguousarray(h.reshape(taps, up).T[:, ::-1]).astype('f4')
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler from in_rate to out_rate, for (channels, frames) or mono blocks.
+
+    Only the output samples are computed, each one a dot product of a single filter phase with the
+    input around it, and the input tail is carried over so consecutive blocks join up seamlessly.
+    The filters are cached per rate ratio, so creating resamplers is cheap.
+    """
+
+    def __init__(self, in_rate, out_rate, taps=32):
+        divisor = math.gcd(int(in_rate), int(out_rate))
+        self.up = int(out_rate) // divisor
+        self.down = int(in_rate) // divisor
+        self.taps = taps
+        self.phases = polyphase_filter(self.up, self.down, taps)
+        self.tail = None
+        self.position = 0       # next output sample, in upsampled units relative to the start of the tail
+
+    def process(self, block):
+        if self.tail is None:
+            # start from silence, which delays the output by half the filter
+            self.tail = np.zeros(block.shape[:-1] + (self.taps - 1,), dtype='f4')
+
+        data = np.concatenate((self.tail, block.astype('f4', copy=False)), axis=-1)
+        # upsampled positions of every output sample with a full set of taps behind it
+        end = (data.shape[-1] - self.taps + 1) * self.up
+        positions = np.arange(self.position, end, self.down)
+
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.taps, axis=-1)
+        out = np.einsum('...nk,nk->...n', windows[..., positions // self.up, :], self.phases[positions % self.up])
+
+        # keep the samples the next output still needs, and move the position along with them
+        start = data.shape[-1] - self.taps + 1
+        self.position = (positions[-1] + self.down if len(positions) else self.position) - start * self.up
+        self.tail = data[..., start:]
+        return out
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Circular buffer of samples, or of (channels, samples) frames when channels is given.
+    """
+
+    def __init__(self, capacity, dtype='f4', channels=None):
+        self.capacity = capacity
+        self.channels = channels
+        self.buffer = np.zeros(capacity if channels is None else (channels, capacity), dtype=dtype)
+        self.total = 0          # samples ever written, doubles as the absolute write position
+
+    def write(self, data):
+        written = data.shape[-1]
+        total = self.total + written
+
+        # only the newest capacity samples can survive a write larger than the buffer
+        data = data[..., -self.capacity:]
+        count = data.shape[-1]
+        start = (total - count) % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            self.buffer[..., start: end] = data
+        else:
+            split = self.capacity - start
+            self.buffer[..., start:] = data[..., :split]
+            self.buffer[..., :end - self.capacity] = data[..., split:]
+
+        # publish the new samples only once they are in place
+        self.total = total
+        return total
+
+    def read(self, index, count):
+        """
+        Read count samples starting at the absolute sample index.
+
+        Returns a view into the buffer where the samples are contiguous, otherwise a single
+        copy stitched together from both ends of the buffer.
+        """
+        start = index % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            return self.buffer[..., start: end]
+        return np.concatenate((self.buffer[..., start:], self.buffer[..., :end - self.capacity]), axis=-1)
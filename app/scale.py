@@ -0,0 +1,123 @@
+import numpy as np
+from config import SAMPLE_RATE, WINDOW_SIZE
+
+
+# display rows resampled by each matmul, few enough that their band of FFT bins stays narrow
+BAND_ROWS = 16
+
+
+def hz_to_mel(hz):
+    return 2595 * np.log10(1 + np.asarray(hz, dtype='f8') / 700)
+
+def mel_to_hz(mel):
+    return 700 * (10 ** (np.asarray(mel, dtype='f8') / 2595) - 1)
+
+
+class FrequencyScale:
+    """
+    Maps the linear FFT bins onto the rows of the display, on a linear, log or mel frequency axis.
+
+    The log and mel mappings are triangular filterbanks, precomputed once. Each triangle only covers a
+    few FFT bins, so the rows are taken BAND_ROWS at a time, each block as a small matrix over just the
+    bins its rows use, and a whole batch of columns is resampled with one matmul per block. The weights
+    are float64 like the magnitudes, so nothing gets converted on the way. Each row of weights sums to
+    one, so the output keeps the same dB range as the linear bins.
+    """
+
+    kinds = ("linear", "log", "mel")
+
+    def __init__(self, kind="linear", bins=256, fmin=None, sample_rate=SAMPLE_RATE, fft_size=WINDOW_SIZE):
+        if kind not in self.kinds:
+            raise ValueError(f"unknown frequency scale: {kind}")
+
+        self.kind = kind
+        self.fft_bins = fft_size // 2 + 1
+        self.bin_hz = sample_rate / fft_size
+        self.nyquist = sample_rate / 2
+
+        if kind == "linear":
+            self.bins = self.fft_bins
+            self.fmin = 0.0
+            self.bands = None
+            return
+
+        self.bins = bins
+        self.fmin = fmin if fmin is not None else (30.0 if kind == "log" else 0.0)
+
+        # band edges evenly spaced on the warped axis, row i is the triangle between edges i and i + 2
+        lo, hi = self.warp(self.fmin), self.warp(self.nyquist)
+        self.step = (hi - lo) / (bins + 1)
+        edges = self.unwarp(lo + self.step * np.arange(bins + 2))
+        self.centres = edges[1:-1]
+
+        freqs = np.arange(self.fft_bins) * self.bin_hz
+        lower, centre, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+        rising = (freqs - lower) / (centre - lower)
+        falling = (upper - freqs) / (upper - centre)
+        weights = np.maximum(0, np.minimum(rising, falling))
+
+        # rows narrower than an FFT bin catch nothing, interpolate between the two nearest bins instead
+        empty = weights.sum(axis=1) == 0
+        for row in np.flatnonzero(empty):
+            position = self.centres[row] / self.bin_hz
+            left = min(int(position), self.fft_bins - 2)
+            weights[row, left: left + 2] = [left + 1 - position, position - left]
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        # (first row, last row + 1, first bin, last bin + 1, (bins, rows) weights) of every block of rows
+        self.bands = []
+        for row in range(0, bins, BAND_ROWS):
+            block = weights[row: row + BAND_ROWS]
+            used = np.flatnonzero(block.any(axis=0))
+            start, stop = used[0], used[-1] + 1
+            self.bands.append((row, row + len(block), start, stop, np.ascontiguousarray(block[:, start: stop].T)))
+
+    def warp(self, hz):
+        if self.kind == "mel":
+            return hz_to_mel(hz)
+        if self.kind == "log":
+            return np.log(np.maximum(hz, 1e-3))
+        return np.asarray(hz, dtype='f8')
+
+    def unwarp(self, value):
+        if self.kind == "mel":
+            return mel_to_hz(value)
+        if self.kind == "log":
+            return np.exp(value)
+        return np.asarray(value, dtype='f8')
+
+    def apply(self, magnitudes):
+        """
+        Resample (..., fft_bins) magnitudes onto the (..., bins) rows of the display.
+        """
+        if self.bands is None:
+            return magnitudes
+        rows = np.empty(magnitudes.shape[:-1] + (self.bins,), dtype=np.result_type(magnitudes, 'f8'))
+        for first, last, start, stop, weights in self.bands:
+            np.matmul(magnitudes[..., start: stop], weights, out=rows[..., first: last])
+        return rows
+
+    def position(self, hz):
+        """
+        Height of a frequency on the display as a fraction, 0.0 at the bottom and 1.0 at the top.
+        """
+        if self.kind == "linear":
+            # linear rows are the FFT bins themselves, the top row ends half a bin past nyquist
+            return hz / (self.fft_bins * self.bin_hz)
+        return ((self.warp(hz) - self.warp(self.fmin)) / self.step - 0.5) / self.bins
+
+    def ticks(self, spacing=0.04):
+        # frequencies worth labelling on this axis, at least spacing apart so the labels don't collide
+        if self.kind == "linear":
+            # a round number of Hz, about every 4.5 spacings, so 2 kHz at 22050 Hz
+            target = self.nyquist * spacing * 4.5
+            step = min(m * 10 ** e for e in range(1, 6) for m in (1, 2, 5) if m * 10 ** e >= target)
+            return list(range(0, int(self.nyquist), step))
+
+        ticks = []
+        for hz in [m * 10 ** e for e in range(1, 5) for m in (1, 2, 5)]:
+            if not self.fmin < hz < self.nyquist or not 0 <= self.position(hz) <= 1:
+                continue
+            if not ticks or self.position(hz) - self.position(ticks[-1]) >= spacing:
+                ticks.append(hz)
+        return ticks
@@ -0,0 +1,391 @@
+import math
+import os
+import tempfile
+import threading
+import time
+from config import WINDOW_WIDTH, WINDOW_HEIGHT, METRICS_OVERLAY, ANALYSIS_THREAD
+from config import FREQUENCY_SCALE, FREQUENCY_BINS, HISTORY_DIR, HISTORY_LEVELS, RECORD_DIR, RECORD_COLUMNS
+from config import STFT_CACHE_DIR, FEATURES, FEATURES_OVERLAY
+from cache import STFTCache
+from features import Features
+from history import History
+from metrics import metrics
+from overlay import MetricsOverlay, FeatureOverlay
+from pipeline import Analyser
+from recorder import Recorder
+from source import File, Microphone
+from wave import Wave
+from spectrogram import Spectrogram
+from utils import logger
+from rect import Rect
+from scheduler import HopScheduler
+from shapes import Shapes
+from ticks import Ticks
+from text import Text
+
+
+class Scene:
+    """
+    The source and node graph that App draws, kept apart from the Qt window so it can also be
+    driven from a standalone OpenGL context. Whoever mixes it in provides self.ctx before init().
+    """
+
+    threaded = ANALYSIS_THREAD
+
+    def __init__(self):
+        self.ctx = None
+        self.source = None
+        self.wave = None
+        self.spectrogram = None
+        self.scheduler = None
+        self.analyser = None
+        self.history = None
+        self.recorder = None
+        self.cache = None
+        self.features = None
+        self.browsing = None        # (zoom level, end column) while looking back through the history
+        self.loop_start = None      # frame marked as the start of a loop, until its end is marked too
+        self.analysis = None
+        self.axes = None
+        self.text = None
+        self.view_size = None
+        self.nodes = []
+
+    def create_source(self):
+        return Microphone()
+        # return File(r"<add path to audio file here>")
+
+    def init(self):
+        logger.info("init")
+        self.source = self.create_source()
+        self.analysis = self.source.analysis
+        # everything time or frequency related follows the rate the source actually delivers
+        rate = self.source.rate
+        self.scheduler = HopScheduler(hop_rate=rate / self.analysis.hop_size)
+
+        channels = self.source.channels
+
+        if RECORD_DIR:
+            path = os.path.join(RECORD_DIR, time.strftime("%Y%m%d-%H%M%S"))
+            self.recorder = Recorder(path, rate, columns=RECORD_COLUMNS, hop_size=self.analysis.hop_size)
+            self.recorder.start()
+            self.source.recorder = self.recorder
+        # only now, so the recording starts at the first sample
+        self.source.start()
+
+        self.wave = Wave(self.ctx, 0, 0, WINDOW_WIDTH, WINDOW_HEIGHT // 3, channels=channels, hop_size=self.analysis.hop_size)
+        self.nodes.append(self.wave)
+        scale = self.analysis.scale(FREQUENCY_SCALE, FREQUENCY_BINS, rate)
+        self.history = self.create_history(scale)
+        if FEATURES:
+            self.features = Features(self.analysis, rate, channels)
+        self.spectrogram = Spectrogram(self.ctx, 0, self.wave.h, WINDOW_WIDTH, (1.76 * WINDOW_HEIGHT) // 3, gpu_colour=True, scale=scale, history=self.history, channels=channels, recorder=self.recorder, analysis=self.analysis, features=self.features)
+        self.nodes.append(self.spectrogram)
+
+        if STFT_CACHE_DIR and getattr(self.source, "file_name", None):
+            self.cache = STFTCache(STFT_CACHE_DIR)
+            self.load_cache()
+
+        if self.threaded:
+            self.analyser = Analyser(self.source, self.spectrogram)
+            self.analyser.start()
+
+        bg_colour = (0.06, 0.06, 0.07, 1.0)
+
+        # all the static rectangles are drawn as one batch
+        shapes = []
+
+        # time axis background
+        shapes.append(Rect(self.ctx, 0, 830, WINDOW_WIDTH, 80, bg_colour))
+
+        # frequency axis background
+        shapes.append(Rect(self.ctx, 0, 0, 99, WINDOW_HEIGHT, bg_colour))
+
+        # wave / frequency separator
+        shapes.append(Rect(self.ctx, 0, self.wave.h, WINDOW_WIDTH, 3, bg_colour))
+
+        self.nodes.append(Shapes(self.ctx, shapes))
+
+        # the ticks go in a batch of their own, followed by the text renderer, both redone by build_axes
+        self.axes = Shapes(self.ctx, [])
+        self.text = Text(self.ctx)
+        self.nodes += [self.axes, self.text]
+        self.build_axes()
+
+        if metrics.enabled and METRICS_OVERLAY:
+            self.nodes.append(MetricsOverlay(self.ctx, 110, 20))
+        if self.features and FEATURES_OVERLAY:
+            self.nodes.append(FeatureOverlay(self.ctx, 110, self.wave.h + 20, self.features))
+
+    def load_cache(self):
+        # the live STFT carries on until the cached levels for the current settings are ready
+        self.spectrogram.cache = None
+        analysis, scale = self.analysis, self.spectrogram.scale
+
+        def load():
+            try:
+                levels = self.cache.levels(self.source.file_name, self.source.channels, analysis, scale)
+            except Exception as e:
+                # nothing to lose but the speed up, the live STFT carries on
+                logger.warning(f"stft cache failed: {e!r}")
+                return
+            if self.analysis is analysis:
+                self.spectrogram.cache = levels
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def create_history(self, scale):
+        if not HISTORY_DIR:
+            return None
+        # every configure() starts a new history, so the name needs more than the time to the second
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        path = tempfile.mkdtemp(dir=HISTORY_DIR, prefix=time.strftime("%Y%m%d-%H%M%S-"))
+        logger.info(f"recording history to {path}")
+        return History(path, scale.bins, self.source.rate / self.analysis.hop_size, channels=self.source.channels)
+
+    def build_axes(self):
+        # ticks and labels for the current rate, hop and frequency scale
+        channels = self.source.channels
+        scale = self.spectrogram.scale
+        shapes = []
+
+        # one column per hop, with the ticks lined up on the newest column at the right hand edge
+        pixels_per_second = self.source.rate / self.analysis.hop_size
+        for fraction, h, colour in ((20, 15, (0.3, 0.3, 0.4, 1.0)), (10, 20, (0.3, 0.3, 0.4, 1.0)), (1, 25, (0.4, 0.4, 0.5, 1.0))):
+            gap = pixels_per_second / fraction
+            if gap < 2:
+                continue    # too dense to be worth drawing at small hops
+            w = (WINDOW_WIDTH - 100) // gap * gap
+            shapes.append(Ticks(self.ctx, x=WINDOW_WIDTH - w, y=830, w=w, h=h, colour=colour, gap=gap))
+
+        # frequency ticks, wherever the scale puts them, on every channel's tile
+        tile_h = self.spectrogram.tile_h
+        bottoms = [self.spectrogram.y + (channel + 1) * tile_h for channel in range(channels)]
+        frequencies = scale.ticks(spacing=0.04 * channels)
+        heights = [tile_h * scale.position(hz) for hz in frequencies]
+        for bottom in bottoms:
+            shapes.append(Ticks(self.ctx, x=80, y=bottom, w=20, h=0, colour=(0.4, 0.4, 0.5, 1.0), horizontal=False, offsets=[-height for height in heights]))
+
+        axes = Shapes(self.ctx, shapes)
+        self.nodes[self.nodes.index(self.axes)] = axes
+        self.axes.release()
+        self.axes = axes
+        if self.view_size:
+            axes.size(*self.view_size)
+
+        text = self.text
+        text.clear()
+
+        # seconds text, at most every 2 seconds when zoomed out far enough for them to collide
+        every = max(1, math.ceil(40 / pixels_per_second))
+        for i in range(0, int((WINDOW_WIDTH - 100) // pixels_per_second) + 1, every):
+            postfix = "s"
+            if i == 0:
+                postfix = " "
+            x = WINDOW_WIDTH - i * pixels_per_second
+            text.add(f"{i}{postfix}", x, 875, align="center")
+
+        # frequency text
+        for bottom in bottoms:
+            for hz, height in zip(frequencies, heights):
+                text.add(f"{hz} Hz", 70, bottom - height + 4, align="right")
+
+    def configure(self, **changes):
+        """
+        Change the STFT settings while running, any of window_size, hop_size and window.
+
+        Columns already on screen are kept unless the number of frequency rows changes.
+        """
+        analysis = self.analysis.replace(**changes)
+        logger.info(f"analysis: {analysis}")
+
+        # the worker is mid batch with the old settings, so stop it and drop whatever it queued
+        if self.analyser:
+            self.analyser.stop()
+            self.analyser.join()
+
+        self.analysis = analysis
+        self.source.configure(analysis)
+        self.scheduler.hop_rate = self.source.rate / analysis.hop_size
+        self.wave.hop_size = analysis.hop_size
+        if self.recorder:
+            self.recorder.configure(analysis)
+
+        scale = analysis.scale(self.spectrogram.scale.kind, FREQUENCY_BINS, self.source.rate)
+        if self.history is not None:
+            # a new history for the new column rate and rows, browsing the old one makes no sense now
+            self.browsing = None
+            self.history.close()
+            self.history = self.create_history(scale)
+            self.spectrogram.history = self.history
+        self.spectrogram.configure(analysis, scale)
+        self.build_axes()
+        if self.cache:
+            self.load_cache()
+
+        if self.analyser:
+            self.analyser = Analyser(self.source, self.spectrogram)
+            self.analyser.start()
+
+    def win_size(self, w, h):
+        logger.info(f"size, width:{w}, height:{h}")
+        self.view_size = w, h
+        for node in self.nodes:
+            node.size(w, h)
+
+    def draw(self, dt):
+        available = self.source.available()
+        logger.info(f"{available} available buffers")
+        metrics.record("frame_interval", dt)
+        metrics.record("source_backlog", available)
+
+        if self.analyser:
+            # the worker has already done the DSP, all that's left here is picking up its columns
+            skip, take, stride = self.scheduler.plan(dt, self.analyser.depth)
+            self.analyser.skip(skip)
+            columns, samples = self.analyser.take(take)
+            if columns is not None:
+                self.spectrogram.push(columns[:, ::stride])
+                self.wave.push(samples[:, ::stride])
+        else:
+            skip, take, stride = self.scheduler.plan(dt, available)
+            self.source.skip(skip)
+            windows = self.source.get_many(take)
+            hops = self.source.hops and self.source.hops[::stride]
+            windows = windows[:, ::stride]
+            with metrics.timer("dsp_per_hop", items=windows.shape[1]):
+                self.wave.add_many(windows)
+                # every stride-th hop would give the features gaps all through, so they sit those batches out
+                self.spectrogram.add_many(windows, hops, self.source.gain, features=stride == 1)
+
+        with metrics.timer("upload"):
+            self.wave.update()
+            if self.browsing:
+                # still analysed and kept in the history, just not shown until going back to live
+                self.spectrogram.pending = []
+            else:
+                self.spectrogram.update()
+
+        if metrics.enabled:
+            for node in self.nodes:
+                with metrics.timer("draw/" + type(node).__name__):
+                    node.draw()
+            self.source.report()
+            if self.analyser:
+                self.analyser.report()
+            if self.recorder:
+                self.recorder.report()
+            metrics.tick()
+        else:
+            for node in self.nodes:
+                node.draw()
+
+    def live_end(self):
+        # newest history column that is on screen, anything still queued for upload isn't yet
+        return self.history.length(0) - (self.analyser.depth if self.analyser else 0)
+
+    def browse(self, zoom=0, scroll=0):
+        """
+        Look back through the history, zoom in or out by powers of two and scroll by half screens.
+        """
+        if self.history is None:
+            return
+
+        level, end = self.browsing or (0, self.live_end())
+        new_level = min(max(level + zoom, 0), HISTORY_LEVELS - 1)
+        # keep the right hand edge on the same moment across zoom levels
+        end = (end << level) >> new_level
+        end += scroll * (self.spectrogram.w // 2)
+        length = self.history.length(new_level)
+        end = min(max(end, min(self.spectrogram.w, length)), length)
+
+        self.browsing = new_level, end
+        self.spectrogram.load(self.history.view(new_level, end, self.spectrogram.w))
+        logger.info(f"browsing level {new_level}, {end} of {length} columns")
+
+    def go_live(self):
+        if self.browsing is None:
+            return
+        self.browsing = None
+        self.spectrogram.load(self.history.view(0, self.live_end(), self.spectrogram.w))
+
+    def seek(self, seconds, relative=False):
+        """
+        Move playback of a file to the given time, or by it with relative, and redraw the view up to there.
+        """
+        if not self.source.seekable or self.source.frames == 0:
+            # nowhere to move to in an empty file
+            return
+        frame = round(seconds * self.source.rate)
+        if relative:
+            frame += self.source.position
+
+        # whatever the worker has queued is from before the seek
+        if self.analyser:
+            self.analyser.stop()
+            self.analyser.join()
+
+        self.source.seek(frame)
+        self.refill(self.source.resume[0])
+        logger.info(f"seek to {frame / self.source.rate:.2f}s")
+
+        if self.analyser:
+            self.analyser = Analyser(self.source, self.spectrogram)
+            self.analyser.start()
+
+    def refill(self, frame):
+        # the screen full of hops leading up to the frame in one go, rather than waiting for them to play
+        hop_size = self.analysis.hop_size
+        end = -(-frame // hop_size)     # the first hop the source hands out after the seek
+        hops = range(end - self.spectrogram.w, end)
+
+        windows = self.source.windows(hops)
+        levels = self.spectrogram.cached(hops, self.source.gain)
+        if levels is None:
+            levels = self.spectrogram.levels(self.spectrogram.stft(windows))
+        self.browsing = None
+        self.spectrogram.load(levels)
+        self.wave.add_many(windows)
+
+    def pause(self):
+        if self.source.seekable:
+            self.source.pause()
+
+    def mark_loop(self):
+        """
+        The first call marks where a loop starts, the second where it ends and starts looping, the third
+        carries on playing to the end.
+        """
+        if not self.source.seekable or not hasattr(self.source, "set_loop"):
+            return
+        position = self.source.position
+        if self.source.loop is not None:
+            self.source.set_loop()
+            logger.info("loop off")
+        elif self.loop_start is None:
+            self.loop_start = position
+        else:
+            start, end = sorted((self.loop_start, position))
+            self.loop_start = None
+            try:
+                self.source.set_loop(start, end)
+            except ValueError as e:
+                logger.warning(e)
+                return
+            logger.info(f"looping {start / self.source.rate:.2f}s to {end / self.source.rate:.2f}s")
+            # the read ahead has already gone past the end, so start from the top of the loop straight away
+            self.seek(start / self.source.rate)
+
+    def exit(self):
+        logger.info("exit")
+        if self.analyser:
+            self.analyser.stop()
+            self.analyser.join()
+        self.source.release()
+        if self.history is not None:
+            self.history.close()
+        if self.recorder:
+            # after the source, so the last callback has been queued
+            self.recorder.stop()
+            self.recorder.join()
+
@@ -0,0 +1,56 @@
+import math
+from config import SAMPLE_RATE, HOP_SIZE, MAX_LATENCY, CATCH_UP
+
+
+class HopScheduler:
+    """
+    Decides how many hops to consume each frame, so the display keeps pace with the audio.
+
+    Hops are paid out at the hop rate for the time that has actually passed, and whenever the backlog
+    would still be more than max_latency behind the audio after that, the catch-up policy clears the excess:
+
+        batch       process every hop of the backlog in this frame
+        skip        drop the oldest hops unseen
+        decimate    process the backlog but only keep every stride-th hop, compressing time while catching up
+
+    Either way the spectrogram is never more than max_latency behind the source.
+    """
+
+    policies = ("batch", "skip", "decimate")
+
+    def __init__(self, hop_rate=SAMPLE_RATE / HOP_SIZE, max_latency=MAX_LATENCY, policy=CATCH_UP):
+        if policy not in self.policies:
+            raise ValueError(f"unknown catch up policy: {policy}")
+
+        self.hop_rate = hop_rate
+        self.max_latency = max_latency
+        self.policy = policy
+        self.credit = 0.0       # hops earned by elapsed time but not consumed yet
+
+    @property
+    def max_backlog(self):
+        return int(self.max_latency * self.hop_rate)
+
+    def plan(self, dt, backlog):
+        """
+        Plan one frame from the elapsed time and the hops waiting at the source.
+
+        Returns (skip, take, stride): drop skip hops, then consume take hops keeping every stride-th one.
+        """
+        self.credit += dt * self.hop_rate
+        take = min(int(self.credit), backlog)
+        # don't bank time while the source is starved, or the display would race ahead once data arrives
+        self.credit = min(self.credit - take, 1.0)
+
+        skip, stride = 0, 1
+        excess = backlog - take - self.max_backlog
+        if excess > 0:
+            if self.policy == "skip":
+                skip = excess
+            elif self.policy == "batch":
+                take += excess
+            else:
+                stride = math.ceil((take + excess) / max(take, 1))
+                take += excess
+
+        return skip, take, stride
@@ -0,0 +1,75 @@
+import moderngl
+import numpy as np
+from utils import orthographic, program
+
+
+class Shapes:
+    """
+    Draws a fixed set of Rect and Ticks nodes as one batch.
+
+    Vertices of every shape go into a single buffer per primitive type, each carrying its shape's colour,
+    so the whole set costs one draw call for the triangles and one for the lines.
+    """
+
+    vert_shader = """
+#version 330 core
+
+uniform mat4 projection;
+in vec2 vertex;
+in vec4 colour;
+out vec4 vert_colour;
+
+void main() {
+    gl_Position = projection * vec4(vertex, 0.0, 1.0);
+    vert_colour = colour;
+}
+"""
+
+    frag_shader = """
+#version 330 core
+
+in vec4 vert_colour;
+out vec4 out_colour;
+
+void main() {
+    out_colour = vert_colour;
+}
+"""
+
+    def __init__(self, ctx, shapes):
+        self.ctx = ctx
+        self.prog = program(self.ctx, self.vert_shader, self.frag_shader)
+
+        self.vaos = []
+        self.buffers = []
+        for mode in (moderngl.TRIANGLES, moderngl.LINES):
+            batch = [shape for shape in shapes if shape.mode == mode]
+            if not batch:
+                continue
+
+            vertices = []
+            for shape in batch:
+                points = shape.vertices.reshape(-1, 2)
+                colours = np.tile(np.array(shape.colour, dtype='f4'), (len(points), 1))
+                vertices.append(np.hstack((points, colours)))
+            vertices = np.concatenate(vertices).astype('f4')
+
+            buffer = self.ctx.buffer(vertices)
+            vao = self.ctx.vertex_array(self.prog, buffer, 'vertex', 'colour')
+            self.vaos.append((vao, mode))
+            self.buffers.append(buffer)
+
+    def size(self, w, h):
+        projection = orthographic(w, h)
+        self.prog['projection'].write(projection)
+
+    def release(self):
+        # the program is shared, so only the buffers and vertex arrays belong to this batch
+        for vao, _ in self.vaos:
+            vao.release()
+        for buffer in self.buffers:
+            buffer.release()
+
+    def draw(self):
+        for vao, mode in self.vaos:
+            vao.render(mode)
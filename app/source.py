@@ -1,19 +1,61 @@
-import librosa
+import collections
 import math
 import numpy as np
-import pyaudio
+import threading
 import time
-from config import WINDOW_SIZE, HOP_SIZE, SAMPLE_RATE, BUFFER_SIZE
+from config import SAMPLE_RATE, NATIVE_RATE, BUFFER_SIZE, RING_SIZE, CHANNELS
+from analysis import Analysis
+from decode import Decoder, ReadAhead, decode_span, normalise_gain
+from metrics import metrics
+from resample import Resampler
+from ring import RingBuffer
+from utils import logger
+
+try:
+    import pyaudio
+except ImportError:     # only File and Microphone need it, sources fed by hand work without
+    pyaudio = None
+
+
+# PyAudio callback status flags, counted by name in the metrics
+STATUS_FLAGS = {
+    pyaudio.paInputUnderflow: "input_underflow",
+    pyaudio.paInputOverflow: "input_overflow",
+    pyaudio.paOutputUnderflow: "output_underflow",
+    pyaudio.paOutputOverflow: "output_overflow",
+} if pyaudio else {}
 
 
 class Source:
-    def __init__(self, *args, **kwargs):
-        self.audio = pyaudio.PyAudio()
+    """
+    Audio kept in a (channels, samples) ring and handed out as windows. Subclasses fill the ring, from
+    a PyAudio stream callback or otherwise.
+
+    Sources that play a file also say where in it their samples came from, so the windows can be given
+    hop numbers of the file, which stay right across seeks, loops and gaps of silence.
+    """
+
+    # whether there is a file behind the source, which seek(), pause() and read_span() can move around in
+    seekable = False
+
+    def __init__(self, *args, channels=CHANNELS, **kwargs):
+        self.audio = None
         self.complete = False
-        self.data = []
+        self.channels = channels
+        self.rate = SAMPLE_RATE     # the rate of the samples in the ring, which init() may change
+        self.analysis = Analysis()
+        self.ring = RingBuffer(RING_SIZE, channels=channels)
         self.index = 0
-        self.total = 0
+        self.hops = range(0)        # hop numbers of the windows get_many last handed out, None if unknown
+        # (ring position, frame of the file) wherever the samples stop following on, None for ones from no file
+        self.segments = collections.deque([(0, 0)])
+        self.resume = None          # (frame, ring position) of a seek that windows haven't moved to yet
+        self.gain = 1.0             # what the samples in the ring have been scaled by
+        self.overflows = 0
+        self.dropped = 0
+        self.skipped = 0
         self.stream = None
+        self.recorder = None
         self.init(*args, **kwargs)
 
     def init(self, *args, **kwargs):
@@ -22,104 +64,440 @@ class Source:
     def callback(self, in_data, frame_count, time_info, status):
         raise NotImplementedError("source.callback")
 
+    def store(self, data, marks=()):
+        # called from the callback with new (channels, frames) samples, and the (offset, frame) pairs of
+        # where in the file they came from
+        for offset, frame in marks:
+            self.mark(self.total + offset, frame)
+        self.ring.write(data)
+        if self.recorder is not None:
+            self.recorder.add_samples(data)
+
+    def count_status(self, status):
+        if status:
+            for flag, name in STATUS_FLAGS.items():
+                if status & flag:
+                    metrics.count(name)
+
+    def report(self):
+        metrics.gauge("source_overflows", self.overflows)
+        metrics.gauge("source_dropped_samples", self.dropped)
+        metrics.gauge("source_skipped_hops", self.skipped)
+
+    @property
+    def total(self):
+        return self.ring.total
+
+    def mark(self, position, frame):
+        last_position, last_frame = self.segments[-1]
+        if frame is None and last_frame is None:
+            return
+        if frame is not None and last_frame is not None and frame - last_frame == position - last_position:
+            return
+        self.segments.append((position, frame))
+
+    def frame_at(self, position, length):
+        # frame of the file at a ring position, if all length samples from there on follow on from it
+        segments = list(self.segments)
+        ends = [start for start, _ in segments[1:]] + [math.inf]
+        for (start, frame), end in zip(segments, ends):
+            if start <= position and position + length <= end:
+                return None if frame is None else frame + position - start
+        return None
+
+    def landing(self):
+        # where windows carry on after a seek, the first hop of the file from the frame it asked for,
+        # or None while that frame hasn't reached the ring yet
+        target, after = self.resume
+        segments = list(self.segments)
+        ends = [start for start, _ in segments[1:]] + [self.total]
+        for (start, frame), end in zip(segments, ends):
+            if frame is None:
+                continue
+            position = start + target - frame
+            if max(start, after) <= position < end:
+                return position + -target % self.analysis.hop_size
+        return None
+
+    def next_index(self):
+        # ring position of the next window, or None while a seek hasn't got anywhere yet
+        if self.resume is None:
+            return self.index
+        return self.landing()
+
+    def resume_at(self, frame):
+        # windows move on to the frame once playback has got there, seek() in the subclasses moves playback
+        self.resume = frame, self.total
+
+    def read_span(self, start, length):
+        raise NotImplementedError("source.read_span")
+
+    def windows(self, hops):
+        """
+        The (channels, N, window_size) windows of the given hops, read from the file rather than the ring,
+        with silence before its start and past its end.
+        """
+        window_size, hop_size = self.analysis.window_size, self.analysis.hop_size
+        start = hops.start * hop_size
+        length = (len(hops) - 1) * hop_size + window_size
+        skip = min(max(-start, 0), length)
+        samples = np.zeros((self.channels, length), dtype='f4')
+        block = self.read_span(start + skip, length - skip)
+        samples[:, skip: skip + block.shape[1]] = block * self.gain
+        return np.lib.stride_tricks.sliding_window_view(samples, window_size, axis=-1)[:, ::hop_size]
+
+    def configure(self, analysis):
+        # new window and hop sizes take effect from the next window handed out
+        self.analysis = analysis
+
     def get(self):
-        if self.index + WINDOW_SIZE > self.total:
+        window_size, hop_size = self.analysis.window_size, self.analysis.hop_size
+        self.catch_up()
+        if self.available() == 0:
             return None
 
-        a = self.index
-        b = self.index + WINDOW_SIZE
-        data = self.data[a: b]
-        self.index = a + HOP_SIZE
-        return np.array(data)
+        data = self.ring.read(self.index, window_size)
+        self.index += hop_size
+        return data
 
-    def available(self):
-        samples = self.total - self.index
-        samples -= WINDOW_SIZE
-        available = math.ceil(samples / HOP_SIZE)
-        return max(0, available)
-
-    # def available(self):
-    #     samples = self.total - self.index
-    #     samples -= WINDOW_SIZE
-    #     available_test = math.ceil(samples / self.hop_size)
-    #     self.hop_size = HOP_SIZE
-    #     if available_test > 10:
-    #         self.hop_size = HOP_SIZE + 50
-    #
-    #     available = math.ceil(samples / self.hop_size)
-    #     return max(0, available)
-
-    def normalise_audio(self, target_level=0.95, min_threshold=0.1):
+    def get_many(self, count):
         """
-        Normalise audio to target level.
+        Get up to count consecutive windows as one (channels, N, window_size) array.
 
-        Args:
-            target_level: Target peak amplitude (default 0.95)
-            min_threshold: Minimum level below which to amplify (default 0.1)
+        The windows are strided views over a single read from the ring, so no per-window copies are made.
         """
-        max_amplitude = np.max(np.abs(self.data))
+        window_size, hop_size = self.analysis.window_size, self.analysis.hop_size
+        self.catch_up()
+        count = min(count, self.available())
+        if count == 0:
+            return np.zeros((self.channels, 0, window_size), dtype=self.ring.buffer.dtype)
+
+        length = (count - 1) * hop_size + window_size
+        data = self.ring.read(self.index, length)
+        frame = self.frame_at(self.index, length)
+        self.hops = None
+        if frame is not None and frame % hop_size == 0:
+            self.hops = range(frame // hop_size, frame // hop_size + count)
+        self.index += count * hop_size
+        return np.lib.stride_tricks.sliding_window_view(data, window_size, axis=-1)[:, ::hop_size]
 
-        if max_amplitude == 0:
-            print("WARNING: Silent audio detected")
+    def catch_up(self):
+        if self.resume is not None:
+            landing = self.landing()
+            if landing is not None:
+                self.index = landing
+                self.resume = None
+
+        # forget where the samples already behind us came from
+        while len(self.segments) > 1 and self.segments[1][0] <= self.index:
+            self.segments.popleft()
+
+        # the callback may be overwriting the oldest block while we read, so treat it as already lost
+        oldest = self.total - self.ring.capacity + BUFFER_SIZE
+        if self.index >= oldest:
             return
 
-        if max_amplitude > 1.0 or max_amplitude < min_threshold:
-            original_level = max_amplitude
-            self.data = self.data / max_amplitude * target_level
-            action = "reduced" if original_level > 1.0 else "amplified"
-            print(f"Audio {action}: {original_level:.3f} -> {target_level:.3f}")
-        else:
-            print(f"Audio level OK: {max_amplitude:.3f}")
+        hop_size = self.analysis.hop_size
+        hops = math.ceil((oldest - self.index) / hop_size)
+        self.overflows += 1
+        self.dropped += hops * hop_size
+        self.index += hops * hop_size
+        logger.warning(f"source overflow, skipped {hops} hops")
+
+    def available(self):
+        # the number of full windows get() can still hand out, none until a seek has got somewhere
+        index = self.next_index()
+        if index is None:
+            return 0
+        samples = self.total - index
+        samples -= self.analysis.window_size
+        if samples < 0:
+            return 0
+        return samples // self.analysis.hop_size + 1
+
+    def skip(self, count):
+        self.catch_up()
+        count = min(count, self.available())
+        self.index += count * self.analysis.hop_size
+        self.skipped += count
+
+    def start(self):
+        # streams are opened stopped, so whoever owns the source can wire up the recorder first and
+        # nothing that was played or captured goes missing from it
+        if self.stream is not None:
+            self.stream.start_stream()
 
     def release(self):
-        self.stream.close()
-        self.audio.terminate()
+        if self.stream is not None:
+            self.stream.close()
+        if self.audio is not None:
+            self.audio.terminate()
 
 
 class File(Source):
+    """
+    Plays an audio file and analyses what is playing. Playback can be paused, moved anywhere in the file
+    with seek() and kept going round a part of it with set_loop().
+    """
+
+    seekable = True
 
-    def init(self, file_name):
-        self.data, _ = librosa.load(file_name, sr=SAMPLE_RATE)
-        self.normalise_audio(target_level=0.95, min_threshold=0.9)
+    def init(self, file_name, normalise=True):
+        self.file_name = file_name
+        # decode and resample on a background thread, playback only ever sees the read-ahead buffer
+        decoder = Decoder(file_name, rate=None if NATIVE_RATE else SAMPLE_RATE, channels=self.channels)
+        self.rate = decoder.rate
+        self.reader = ReadAhead(decoder)
+        self.reader.start()
+        self.reader.primed.wait()
 
+        self.normalise = normalise
+        self.gain = 1.0
+        self.underruns = 0
+        self.paused = False
+        self.loop = None        # (start, end) frames playing over and over
+
+        self.audio = pyaudio.PyAudio()
         self.stream = self.audio.open(
             format=pyaudio.paFloat32,
-            channels=1,
-            rate=SAMPLE_RATE,
+            channels=self.channels,
+            rate=self.rate,
             output=True,
             frames_per_buffer=BUFFER_SIZE,
             stream_callback=self.callback,
+            start=False,
         )
 
     def callback(self, in_data, frame_count, time_info, status):
-        a = self.total
-        b = self.total + BUFFER_SIZE
-        data = self.data[a: b]
-        self.total = b
-        if self.total >= len(self.data):
+        self.count_status(status)
+        data, marks = self.reader.read(frame_count)
+        if data.shape[1] < frame_count and not self.reader.finished:
+            # the decoder fell behind or is moving to a seek, play silence rather than stopping the stream
+            if self.reader.target is None:
+                self.underruns += 1
+            marks.append((data.shape[1], None))
+            silence = np.zeros((self.channels, frame_count - data.shape[1]), dtype=data.dtype)
+            data = np.concatenate((data, silence), axis=1)
+
+        if self.normalise:
+            # the peak estimate only grows as decoding runs ahead, so the gain never pumps back up
+            gain = normalise_gain(self.reader.peak, target_level=0.95, min_threshold=0.9)
+            if gain != self.gain:
+                logger.info(f"audio gain: {self.gain:.3f} -> {gain:.3f}")
+                self.gain = gain
+            data *= gain
+
+        self.store(data, marks)
+        if self.reader.exhausted:
             self.complete = True
 
-        return data, pyaudio.paContinue
+        # PyAudio wants the channels interleaved
+        return data.T.tobytes(), pyaudio.paContinue
+
+    @property
+    def frames(self):
+        return self.reader.decoder.frames
+
+    @property
+    def position(self):
+        # frame of the file that plays next, give or take the stream's own buffering
+        return self.reader.played
+
+    def seek(self, frame):
+        if self.frames == 0:
+            return
+        frame = min(max(frame, 0), self.frames - 1)
+        self.resume_at(frame)
+        self.reader.seek(frame)
+        self.complete = False
+        if not self.paused and not self.stream.is_active():
+            # the stream stops by itself at the end of the file
+            self.stream.stop_stream()
+            self.stream.start_stream()
+
+    def pause(self):
+        self.paused = not self.paused
+        if self.paused:
+            self.stream.stop_stream()
+        else:
+            self.stream.start_stream()
+
+    def set_loop(self, start=None, end=None):
+        """
+        Play the frames from start to end over and over, or carry on to the end of the file without arguments.
+        """
+        if start is None:
+            self.loop = self.reader.loop = None
+            return
+        end = min(end, self.frames)
+        if not 0 <= start < end:
+            raise ValueError(f"nothing to loop from frame {start} to {end}")
+        self.loop = self.reader.loop = start, end
+
+    def read_span(self, start, length):
+        return decode_span(self.file_name, start, length, rate=self.rate, channels=self.channels)
+
+    def report(self):
+        super().report()
+        metrics.gauge("file_underruns", self.underruns)
+
+    def release(self):
+        self.reader.stop()
+        super().release()
+
+
+class ArraySource(Source):
+    """
+    Samples from an array or an audio file, without PyAudio and without waiting for real time.
+
+    With realtime=True samples arrive as advance(dt) moves a virtual clock along, as if they were playing.
+    Otherwise every sample is available straight away: the ring is topped up as fast as windows are taken,
+    so batch consumers run the pipeline at CPU speed. With loop=True the samples start over at the end.
+    """
+
+    seekable = True
+
+    def init(self, samples, rate=None, realtime=True, loop=False):
+        self.realtime = realtime
+        self.loop = loop
+        self.paused = False
+        self.position = 0       # next frame read
+        self.time = 0.0
+        self.lock = threading.Lock()
+        self.file_name = None
+        self.decoder = None
+        if isinstance(samples, str):
+            self.file_name = samples
+            self.open()
+        else:
+            samples = np.asarray(samples, dtype='f4')
+            if samples.ndim == 1:
+                samples = np.broadcast_to(samples, (self.channels, len(samples)))
+            self.samples = samples
+            self.rate = rate or SAMPLE_RATE
+
+    def open(self):
+        self.decoder = Decoder(self.file_name, rate=None if NATIVE_RATE else SAMPLE_RATE, channels=self.channels)
+        self.rate = self.decoder.rate
+
+    def read(self, count):
+        # the next block of up to count samples, returns (block, whether that was the end)
+        if self.decoder is not None:
+            block = self.decoder.read(count)
+            self.position += block.shape[1]
+            return block, self.decoder.done
+
+        block = self.samples[:, self.position: self.position + count]
+        self.position += block.shape[1]
+        return block, self.position >= self.samples.shape[1]
+
+    def feed(self, count):
+        # write the next count samples into the ring
+        while count > 0 and not self.complete:
+            position = self.position
+            block, end = self.read(count)
+            if block.shape[1]:
+                self.store(block, [(0, position)])
+                count -= block.shape[1]
+            if end and self.loop and (block.shape[1] or position):
+                self.move(0)
+            elif end:
+                # also a loop over nothing at all, which would never get any further
+                self.complete = True
+
+    def move(self, frame):
+        # the next read starts at the given frame
+        if self.decoder is not None:
+            self.decoder.seek(frame)
+        self.position = frame
+
+    @property
+    def frames(self):
+        return self.decoder.frames if self.decoder is not None else self.samples.shape[1]
+
+    def seek(self, frame):
+        with self.lock:
+            if self.frames == 0:
+                return
+            frame = min(max(frame, 0), self.frames - 1)
+            self.resume_at(frame)
+            self.move(frame)
+            self.complete = False
+
+    def pause(self):
+        self.paused = not self.paused
+
+    def read_span(self, start, length):
+        if self.decoder is not None:
+            return decode_span(self.file_name, start, length, rate=self.rate, channels=self.channels)
+        return self.samples[:, start: start + length]
+
+    def advance(self, dt):
+        # move the virtual clock on, everything that would have played by then lands in the ring
+        if self.paused:
+            return
+        self.time += dt
+        self.feed(int(self.time * self.rate) - self.total)
+
+    def fill(self):
+        if self.realtime:
+            return
+        # as far ahead as catch_up allows, under a lock as both the render and analysis threads ask
+        with self.lock:
+            # after a seek the samples from before it don't count, whatever the windows have got to
+            index = self.next_index()
+            if index is None:
+                index = self.total
+            self.feed(index + self.ring.capacity - BUFFER_SIZE - self.total)
+
+    def available(self):
+        self.fill()
+        return super().available()
+
+    def get(self):
+        self.fill()
+        return super().get()
+
+    def get_many(self, count):
+        self.fill()
+        return super().get_many(count)
+
+    def release(self):
+        if self.decoder is not None:
+            self.decoder.close()
 
 
 class Microphone(Source):
 
     def init(self):
+        # always capture at the device's own rate, many devices emulate anything else poorly
+        self.audio = pyaudio.PyAudio()
+        device_rate = int(self.audio.get_default_input_device_info()["defaultSampleRate"])
+        self.resampler = None
+        if NATIVE_RATE:
+            self.rate = device_rate
+        elif device_rate != SAMPLE_RATE:
+            self.resampler = Resampler(device_rate, SAMPLE_RATE)
+        logger.info(f"capturing at {device_rate} Hz, analysing at {self.rate} Hz")
+
         # create audio stream
         self.stream = self.audio.open(
             format=pyaudio.paFloat32,
-            channels=1,
-            rate=SAMPLE_RATE,
+            channels=self.channels,
+            rate=device_rate,
             input=True,
             frames_per_buffer=BUFFER_SIZE,
             stream_callback=self.callback,
+            start=False,
         )
 
     def callback(self, in_data, frame_count, time_info, status):
-        data = np.frombuffer(in_data, dtype=np.float32)
-        data = data.tolist()
-        self.data.extend(data)
-        self.total = len(self.data)
+        self.count_status(status)
+        # deinterleave into (channels, frames)
+        data = np.frombuffer(in_data, dtype=np.float32).reshape(-1, self.channels).T
+        if self.resampler is not None:
+            data = self.resampler.process(data)
+        self.store(data)
 
         return None, pyaudio.paContinue
 
@@ -127,4 +505,5 @@ class Microphone(Source):
 if __name__ == "__main__":
     filename = r"../audio/SuperTwintris.wav"
     source = File(filename)
+    source.start()
     time.sleep(5)
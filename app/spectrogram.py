@@ -1,32 +1,41 @@
 import numpy as np
-from config import WINDOW_SIZE
-from librosa import amplitude_to_db     # takes a couple of seconds!
-import matplotlib
+from analysis import Analysis
+from colours import INFERNO
+from config import SAMPLE_RATE
+from metrics import metrics
 from utils import orthographic
 
 
-hanning = np.hanning(WINDOW_SIZE)
-colour_map = matplotlib.colormaps.get_cmap('inferno')
+default_analysis = Analysis()
+colour_map = INFERNO
 
 
-def stft_slice(window):
-    data_length = window.shape[0]
-    if data_length < WINDOW_SIZE:
-        padded_data = np.zeros(WINDOW_SIZE, dtype=window.dtype)
-        padded_data[:data_length] = window
+def stft_slice(window, analysis=default_analysis):
+    # works on a single window or on a (..., N, window_size) stack of them
+    data_length = window.shape[-1]
+    if data_length < analysis.window_size:
+        padded_data = np.zeros(window.shape[:-1] + (analysis.window_size,), dtype=window.dtype)
+        padded_data[..., :data_length] = window
         window = padded_data
-    tapered = window * hanning
-    return np.fft.rfft(tapered)
+    tapered = window * analysis.taper
+    return np.fft.rfft(tapered, axis=-1)
 
-def stft_colour(signal_slice, min_db=-25, max_db=30):
-    signal_slice = np.abs(signal_slice)
-    signal_slice = amplitude_to_db(signal_slice)
+def stft_db(signal_slice, amin=1e-5):
+    # the same scale as librosa's amplitude_to_db with ref=1.0, without the top_db floor
+    return 20 * np.log10(np.maximum(amin, np.abs(signal_slice)))
+
+def stft_colour(signal_slice, min_db=-25, max_db=30, top_db=80.0):
+    return db_colour(stft_db(signal_slice), min_db, max_db, top_db)
+
+def db_colour(signal_slice, min_db=-25, max_db=30, top_db=80.0):
+    # apply the top_db floor per column so a batch colours exactly like single slices
+    signal_slice = np.maximum(signal_slice, signal_slice.max(axis=-1, keepdims=True) - top_db)
     signal_slice = signal_slice.clip(min_db, max_db)
     signal_slice = (signal_slice - min_db) / (max_db - min_db)
-    signal_slice = colour_map(signal_slice)
-    signal_slice = (signal_slice * 255).astype('u1')
-    signal_slice = signal_slice[:, :3]
-    return signal_slice
+    # index the colour map the way matplotlib does, the top of the range lands on the last entry
+    size = len(colour_map)
+    signal_slice = np.minimum((signal_slice * size).astype(int), size - 1)
+    return colour_map[signal_slice]
 
 
 class Spectrogram:
@@ -36,9 +45,9 @@ class Spectrogram:
         
         uniform mat4 projection;
         in vec2 in_vert;
-        in vec2 in_uv;
+        in vec3 in_uv;
         
-        out vec2 v_uv;
+        out vec3 v_uv;
         
         void main() {
             gl_Position = projection * vec4(in_vert, 0.0, 1.0);
@@ -49,61 +58,236 @@ class Spectrogram:
     fragment_shader = """
         #version 330 core
 
-        uniform sampler2D image;    
-        in vec2 v_uv;
+        uniform sampler2DArray image;    
+        uniform float offset;
+        in vec3 v_uv;
         
         out vec4 f_colour;
         
         void main() {
-            vec4 colour = texture(image, v_uv);
+            // the texture is a circular buffer, offset points at its oldest column, and each channel is a layer
+            vec4 colour = texture(image, vec3(v_uv.x + offset, v_uv.yz));
             f_colour = vec4(colour.rgb, 1.0);
         }
 """
 
-    def __init__(self, ctx, x, y, w, h):
+    lut_fragment_shader = """
+        #version 330 core
+
+        uniform sampler2DArray image;
+        uniform sampler2D lut;
+        uniform float offset;
+        uniform float min_db, max_db;
+        in vec3 v_uv;
+
+        out vec4 f_colour;
+
+        void main() {
+            // the image holds dB values, map them through the colour map exactly like stft_colour does
+            float db = texture(image, vec3(v_uv.x + offset, v_uv.yz)).r;
+            float level = clamp((db - min_db) / (max_db - min_db), 0.0, 1.0);
+            int size = textureSize(lut, 0).x;
+            int index = min(int(level * size), size - 1);
+            f_colour = vec4(texelFetch(lut, ivec2(index, 0), 0).rgb, 1.0);
+        }
+"""
+
+    def __init__(self, ctx, x, y, w, h, gpu_colour=False, min_db=-25, max_db=30, scale=None, history=None, channels=1, recorder=None, analysis=default_analysis, features=None):
         self.ctx = ctx
         self.x = x
         self.y = y
         self.w = w
         self.h = h
+        self.gpu_colour = gpu_colour
+        self.history = history
+        self.recorder = recorder
+        self.features = features
+        self.cache = None       # (hops, channels, bins) levels of the whole source, see cache.py
+        self.channels = channels
+        self.analysis = analysis
+        self.scale = scale or analysis.scale("linear", analysis.bins, SAMPLE_RATE)
+        self.bins = self.scale.bins
+        self.texture = None
         self.prog = self.ctx.program(
             vertex_shader=self.vertex_shader,
-            fragment_shader=self.fragment_shader,
+            fragment_shader=self.lut_fragment_shader if gpu_colour else self.fragment_shader,
         )
 
-        vertices = np.array([
-            0, y, 0, 1,         # A
-            0, y + h, 0, 0,     # B
-            w, y + h, 1, 0,     # C
-            0, y, 0, 1,         # A
-            w, y + h, 1, 0,     # C
-            w, y, 1, 1,         # D
-        ])
+        # one tile per channel stacked top to bottom, all drawn in one go from the layers of a texture array
+        self.tile_h = h / channels
+        vertices = []
+        for channel in range(channels):
+            top, bottom = y + channel * self.tile_h, y + (channel + 1) * self.tile_h
+            vertices += [
+                0, top, 0, 1, channel,          # A
+                0, bottom, 0, 0, channel,       # B
+                w, bottom, 1, 0, channel,       # C
+                0, top, 0, 1, channel,          # A
+                w, bottom, 1, 0, channel,       # C
+                w, top, 1, 1, channel,          # D
+            ]
 
-        vertices = vertices.astype('f4')
+        vertices = np.array(vertices, dtype='f4')
         buffer = self.ctx.buffer(vertices)
         self.vao = self.ctx.vertex_array(self.prog, buffer, 'in_vert', 'in_uv')
 
-        self.frame = np.zeros((513, self.w, 3), dtype='u1')
+        if gpu_colour:
+            self.lut = self.ctx.texture(size=(len(colour_map), 1), components=3, data=colour_map)
+            self.prog['lut'] = 1
+        self.set_range(min_db, max_db)
+        self.allocate()
+
+    def allocate(self):
+        # (re)create the texture for the current bin count, starting from an empty view
+        # in gpu_colour mode the texture holds single channel dB values and the shader does the colour mapping
+        components, dtype = (1, 'f4') if self.gpu_colour else (3, 'f1')
+        self.slice = np.zeros((self.channels, self.bins, components), dtype='f4' if self.gpu_colour else 'u1')
+        if self.gpu_colour:
+            self.slice[:] = self.min_db
 
-        self.texture = self.ctx.texture(size=(self.w, 513), components=3, data=self.frame)
-        self.texture.repeat_x = False
+        if self.texture is not None:
+            self.texture.release()
+        self.texture = self.ctx.texture_array(size=(self.w, self.bins, self.channels), components=components, dtype=dtype)
+        self.texture.write(np.tile(self.slice[:, :, np.newaxis], (1, 1, self.w, 1)))
+        self.texture.repeat_x = True    # wrap filtering across the seam of the circular buffer
         self.texture.repeat_y = False
 
-        self.slice = np.zeros((513, 3), dtype='u1')
+        self.column = 0     # next column to write, which is also the oldest one on screen
+        self.pending = []
+        self.prog['offset'] = 0.0
 
-    def add(self, window):
-        self.frame[:, :-1, :] = self.frame[:, 1:, :]
+    def configure(self, analysis, scale):
+        """
+        Switch to new STFT settings. The texture is only reallocated when the number of rows changes,
+        otherwise the columns already on screen stay put and new ones carry on after them.
+        """
+        self.analysis = analysis
+        self.scale = scale
+        if self.features is not None:
+            self.features.configure(analysis)
+        if scale.bins != self.bins:
+            self.bins = scale.bins
+            self.allocate()
+
+    def set_range(self, min_db, max_db):
+        # only takes effect in gpu_colour mode, where contrast is a pair of uniforms
+        self.min_db = min_db
+        self.max_db = max_db
+        if self.gpu_colour:
+            self.prog['min_db'] = min_db
+            self.prog['max_db'] = max_db
+
+    def stft(self, windows):
+        return stft_slice(windows, self.analysis)
 
+    def levels(self, data_slices):
+        # dB level of every display row
+        return stft_db(self.scale.apply(np.abs(data_slices)))
+
+    def colour(self, levels):
+        if self.gpu_colour:
+            return levels[..., np.newaxis].astype('f4')
+        return db_colour(levels, self.min_db, self.max_db)
+
+    def analyse(self, windows, hops=None, gain=1.0, features=True):
+        """
+        Columns for a (channels, N, window_size) stack of windows. hops is the range of hop numbers they
+        were taken from and gain what the source scaled them by, which lets a cached copy stand in for
+        running the STFT. features=False leaves the features out, e.g. for windows that skip hops.
+        """
+        features = self.features if features else None
+        # the features need the magnitudes, so they are worked out even when the levels are cached
+        levels = self.cached(hops, gain) if features is None else None
+        if levels is None:
+            magnitudes = np.abs(self.stft(windows))
+            if features is not None:
+                features.add(magnitudes, windows, hops)
+            levels = stft_db(self.scale.apply(magnitudes))
+        return self.finish(levels)
+
+    def cached(self, hops, gain=1.0):
+        # (channels, N, bins) levels of the given hops from the cache, None unless it has every one of them
+        cache = self.cache
+        if cache is None or not hops or hops.start < 0 or hops[-1] >= len(cache):
+            return None
+        levels = cache[hops.start: hops.stop: hops.step].transpose(1, 0, 2).astype('f4')
+        if gain != 1.0:
+            levels += 20 * np.log10(gain)
+        return levels
+
+    def columns(self, data_slices):
+        return self.finish(self.levels(data_slices))
+
+    def finish(self, levels):
+        if self.history is not None:
+            self.history.append(levels)
+        if self.recorder is not None:
+            self.recorder.add_columns(levels)
+        return self.colour(levels)
+
+    def add(self, window):
+        # window is one (channels, window_size) hop
         if window is not None:
-            data_slice = stft_slice(window)
-            data_slice = stft_colour(data_slice)
+            data_slice = self.stft(window)
+            data_slice = self.columns(data_slice)
             self.slice = data_slice
 
-        self.frame[:, -1, :] = self.slice
+        self.pending.append(self.slice[:, np.newaxis])
+
+    def add_many(self, windows, hops=None, gain=1.0, features=True):
+        # only the newest w windows can still be seen, unless every one of them has to be kept
+        count = windows.shape[1]
+        if self.history is None and self.recorder is None and (self.features is None or not features):
+            count = min(count, self.w)
+        if count == 0:
+            return
+
+        # a single rfft over every channel and hop
+        data_slices = self.analyse(windows[:, -count:], hops and hops[-count:], gain, features)
+        self.push(data_slices)
+
+    def push(self, data_slices):
+        # queue (channels, N, bins, components) columns that were already computed by columns(),
+        # e.g. on the analysis thread
+        if data_slices.shape[1] == 0:
+            return
+        self.slice = data_slices[:, -1]
+        self.pending.append(data_slices[:, -self.w:])
+
+    def load(self, levels):
+        """
+        Replace the whole view with the given (channels, N, bins) dB levels, newest on the right.
+        """
+        levels = levels[:, -self.w:]
+        silence = np.full((self.channels, self.w - levels.shape[1], self.bins), stft_db(0.0), dtype='f4')
+        columns = self.colour(np.concatenate((silence, levels), axis=1))
+
+        self.pending = []
+        self.column = 0
+        self.texture.write(np.ascontiguousarray(columns.transpose(0, 2, 1, 3)))
+        self.prog['offset'] = 0.0
 
     def update(self):
-        self.texture.write(self.frame)
+        if not self.pending:
+            return
+
+        columns = np.concatenate(self.pending, axis=1)[:, -self.w:]
+        self.pending = []
+
+        # texture rows are frequency bins, so upload the new columns of every layer as one (bins, count)
+        # sub-rectangle, split in two where they wrap around the right hand edge
+        count = columns.shape[1]
+        columns = columns.transpose(0, 2, 1, 3)
+        first = min(count, self.w - self.column)
+        layers = self.channels
+        self.texture.write(np.ascontiguousarray(columns[:, :, :first]), viewport=(self.column, 0, 0, first, self.bins, layers))
+        if first < count:
+            self.texture.write(np.ascontiguousarray(columns[:, :, first:]), viewport=(0, 0, 0, count - first, self.bins, layers))
+
+        self.column = (self.column + count) % self.w
+        self.prog['offset'] = self.column / self.w
+        metrics.record("upload_bytes/spectrogram", columns.nbytes)
+        metrics.count("upload_bytes", columns.nbytes)
 
     def size(self, w, h):
         projection = orthographic(w, h)
@@ -111,4 +295,6 @@ class Spectrogram:
 
     def draw(self):
         self.texture.use(0)
+        if self.gpu_colour:
+            self.lut.use(1)
         self.vao.render()
@@ -1,15 +1,18 @@
 import freetype
 import numpy as np
+import os
 from utils import orthographic
 
 
 SCALE = 2
 FONT_SIZE = 12
+ATLAS_WIDTH = 512
+ATLAS_PADDING = 2       # empty texels around each glyph so linear filtering can't bleed between them
 
 
 class CharacterSlot:
 
-    def __init__(self, ctx, glyph):
+    def __init__(self, glyph):
         if not isinstance(glyph, freetype.GlyphSlot):
             raise RuntimeError('unknown glyph type')
 
@@ -17,12 +20,8 @@ class CharacterSlot:
         self.height = glyph.bitmap.rows
         self.advance = glyph.advance.x
 
-        glyph_size = (self.width, self.height)
-
-        data = np.array(glyph.bitmap.buffer, dtype='u1')
-        self.texture = ctx.texture(glyph_size, 1, data)
-        self.texture.repeat_x = False
-        self.texture.repeat_y = False
+        self.bitmap = np.array(glyph.bitmap.buffer, dtype='u1').reshape(self.height, self.width)
+        self.uv = (0.0, 0.0, 0.0, 0.0)      # u0, v0, u1, v1 within the atlas, set once it is packed
 
 
 class Text:
@@ -67,9 +66,12 @@ class Text:
 
         self.vao = self.ctx.vertex_array(self.prog, self.vbo, 'vertex', 'uv')
 
-        self.init_font(r"..\fonts\Rubik-Regular.ttf")
+        self.atlas = None
+        self.init_font(os.path.join(os.path.dirname(__file__), "..", "fonts", "Rubik-Regular.ttf"))
 
         self.texts = []
+        self.vertex_count = 0
+        self.dirty = False
 
     def init_font(self, font):
         self.characters = dict()
@@ -82,20 +84,39 @@ class Text:
         for i in range(30, 128):
             char = chr(i)
             face.load_char(char)
-            character = CharacterSlot(self.ctx, face.glyph)
+            character = CharacterSlot(face.glyph)
             self.characters[char] = character
 
-    def set_geometry(self, x, y, w, h):
-        vertices = np.array([
-            x, y, 0, 1,
-            x + w, y, 1, 1,
-            x + w, y - h, 1, 0,
-            x, y, 0, 1,
-            x + w, y - h, 1, 0,
-            x, y - h, 0, 0,
-        ])
-        vertices = vertices.astype('f4')
-        self.vbo.write(vertices)
+        self.init_atlas()
+
+    def init_atlas(self):
+        # pack every glyph into rows of a single texture, so all text can be drawn with one texture bound
+        x, y, row_height = ATLAS_PADDING, ATLAS_PADDING, 0
+        positions = {}
+        for char, character in self.characters.items():
+            if x + character.width + ATLAS_PADDING > ATLAS_WIDTH:
+                x = ATLAS_PADDING
+                y += row_height + ATLAS_PADDING
+                row_height = 0
+            positions[char] = (x, y)
+            x += character.width + ATLAS_PADDING
+            row_height = max(row_height, character.height)
+
+        atlas_height = y + row_height + ATLAS_PADDING
+        atlas = np.zeros((atlas_height, ATLAS_WIDTH), dtype='u1')
+        for char, (x, y) in positions.items():
+            character = self.characters[char]
+            atlas[y: y + character.height, x: x + character.width] = character.bitmap
+            character.uv = (
+                x / ATLAS_WIDTH,
+                y / atlas_height,
+                (x + character.width) / ATLAS_WIDTH,
+                (y + character.height) / atlas_height,
+            )
+
+        self.atlas = self.ctx.texture((ATLAS_WIDTH, atlas_height), 1, atlas)
+        self.atlas.repeat_x = False
+        self.atlas.repeat_y = False
 
     def text_width(self, text):
         w = 0
@@ -104,26 +125,67 @@ class Text:
             w += (character.advance >> 6) / SCALE
         return w
 
+    def text_vertices(self, text, x, y, align):
+        if align == 'center':
+            x -= self.text_width(text) / 2
+        if align == 'right':
+            x -= self.text_width(text)
+
+        vertices = []
+        for c in text:
+            character = self.characters[c]
+            w = character.width / SCALE
+            h = character.height / SCALE
+            u0, v0, u1, v1 = character.uv
+            if w and h:
+                vertices += [
+                    x, y, u0, v1,
+                    x + w, y, u1, v1,
+                    x + w, y - h, u1, v0,
+                    x, y, u0, v1,
+                    x + w, y - h, u1, v0,
+                    x, y - h, u0, v0,
+                ]
+            x += (character.advance >> 6) / SCALE
+        return vertices
+
+    def layout(self):
+        # lay out every label into one vertex buffer, only needed when a label has changed
+        vertices = []
+        for text, x, y, align in self.texts:
+            vertices += self.text_vertices(text, x, y, align)
+        vertices = np.array(vertices, dtype='f4')
+
+        if vertices.nbytes > self.vbo.size:
+            self.vbo.orphan(vertices.nbytes)
+        self.vbo.write(vertices)
+        self.vertex_count = len(vertices) // 4
+        self.dirty = False
+
     def add(self, text, x, y, align='left'):
         self.texts.append((text, x, y, align))
+        self.dirty = True
+        return len(self.texts) - 1
+
+    def clear(self):
+        self.texts = []
+        self.dirty = True
+
+    def set_text(self, label, text):
+        old_text, x, y, align = self.texts[label]
+        if text != old_text:
+            self.texts[label] = (text, x, y, align)
+            self.dirty = True
 
     def size(self, w, h):
         projection = orthographic(w, h)
         self.prog['projection'].write(projection)
 
     def draw(self):
-        for text, x, y, align in self.texts:
-            if align == 'center':
-                w = self.text_width(text)
-                x -= w / 2
-            if align == 'right':
-                w = self.text_width(text)
-                x -= w
-            for i, c in enumerate(text):
-                character = self.characters[c]
-                character.texture.use(0)
-                w = character.width
-                h = character.height
-                self.set_geometry(x, y, w / SCALE, h / SCALE)
-                self.vao.render()
-                x += (character.advance >> 6) / SCALE
+        if self.dirty:
+            self.layout()
+        if self.vertex_count == 0:
+            return
+
+        self.atlas.use(0)
+        self.vao.render(vertices=self.vertex_count)
@@ -1,6 +1,6 @@
 import moderngl
 import numpy as np
-from utils import orthographic
+from utils import orthographic, program
 
 
 class Ticks:
@@ -27,36 +27,49 @@ void main() {
 }
 """
 
-    def __init__(self, ctx, x, y, w, h, colour=(1.0, 0.0, 1.0, 1.0), gap=50, horizontal=True):
+    mode = moderngl.LINES
+
+    def __init__(self, ctx, x, y, w, h, colour=(1.0, 0.0, 1.0, 1.0), gap=50, horizontal=True, offsets=None):
         self.ctx = ctx
         self.x = x
         self.y = y
         self.w = w
         self.h = h
-        self.prog = self.ctx.program(
-            vertex_shader=self.vert_shader,
-            fragment_shader=self.frag_shader,
-        )
-        self.prog['colour'] = colour
-
-        if horizontal:
-            num_ticks = int(w) // int(gap) + 1
-        else:
-            num_ticks = int(h) // int(gap) + 1
+        self.colour = colour
+        self.prog = program(self.ctx, self.vert_shader, self.frag_shader)
 
-        vertices = np.zeros(num_ticks * 4, dtype='f4')
-        for idx in range(num_ticks):
+        # evenly spaced by gap unless explicit offsets are given, e.g. for a log frequency axis
+        if offsets is None:
+            # allow for rounding when the length is an exact multiple of a fractional gap
             if horizontal:
-                vertices[idx * 4: (idx + 1) * 4] = [x + idx * gap, y, x + idx * gap, y + h]
+                num_ticks = int(w / gap + 1e-6) + 1
             else:
-                vertices[idx * 4: (idx + 1) * 4] = [x, y + idx * gap, x + w, y + idx * gap]
+                num_ticks = int(h / gap + 1e-6) + 1
+            offsets = np.arange(num_ticks) * gap
+        offsets = np.asarray(offsets)
+        num_ticks = len(offsets)
+
+        # one line per tick, (x0, y0, x1, y1)
+        vertices = np.empty((num_ticks, 4), dtype='f4')
+        if horizontal:
+            vertices[:, 0] = vertices[:, 2] = x + offsets
+            vertices[:, 1] = y
+            vertices[:, 3] = y + h
+        else:
+            vertices[:, 0] = x
+            vertices[:, 2] = x + w
+            vertices[:, 1] = vertices[:, 3] = y + offsets
 
-        buffer = self.ctx.buffer(vertices)
-        self.vao = self.ctx.vertex_array(self.prog, buffer, 'vertex')
+        self.vertices = vertices.ravel()
+        self.vao = None     # only created when drawn on its own rather than as part of Shapes
 
     def size(self, w, h):
         projection = orthographic(w, h)
         self.prog['projection'].write(projection)
 
     def draw(self):
-        self.vao.render(mode=moderngl.LINES)
+        if self.vao is None:
+            buffer = self.ctx.buffer(self.vertices)
+            self.vao = self.ctx.vertex_array(self.prog, buffer, 'vertex')
+        self.prog['colour'] = self.colour
+        self.vao.render(mode=self.mode)
@@ -10,6 +10,21 @@ def orthographic(w, h):
 # end region projection
 
 
+# region shaders
+
+programs = {}
+
+
+def program(ctx, vertex_shader, fragment_shader):
+    # identical shaders are compiled once per context and shared, so uniforms must be set before each draw
+    key = (ctx, vertex_shader, fragment_shader)
+    if key not in programs:
+        programs[key] = ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
+    return programs[key]
+
+# end region shaders
+
+
 # region logger
 
 # create custom logger
@@ -1,5 +1,7 @@
 import moderngl
 import numpy as np
+from config import HOP_SIZE
+from metrics import metrics
 from utils import orthographic
 
 
@@ -10,11 +12,15 @@ class Wave:
 
 uniform mat4 projection;
 uniform float x, y, h;
+uniform int offset, columns, channels;
 in float sample;
 
 void main() {
-    int x_interp = gl_VertexID / 2;
-    float height = (h / 2) + sample * (h / 2);
+    // samples sit in a circular buffer of (min, max) pairs for every channel, offset is the slot of the oldest
+    int slot = gl_VertexID / 2;
+    int channel = slot % channels;
+    int x_interp = (slot / channels - offset + columns) % columns;
+    float height = channel * h + (h / 2) + sample * (h / 2);
     gl_Position = projection * vec4(x + x_interp, y + height, 0.0, 1.0);
 }
 """
@@ -29,7 +35,7 @@ void main() {
 }
 """
 
-    def __init__(self, ctx, x, y, w, h):
+    def __init__(self, ctx, x, y, w, h, channels=1, hop_size=HOP_SIZE):
         self.ctx = ctx
         self.x = x
         self.y = y
@@ -39,28 +45,76 @@ void main() {
             vertex_shader=self.vert_shader,
             fragment_shader=self.frag_shader,
         )
-        self.samples = np.zeros(int(w * 2), dtype='f4')
-        self.buffer = ctx.buffer(reserve=self.samples.nbytes, dynamic=True)
+        self.columns = int(w)
+        self.channels = channels
+        self.hop_size = hop_size
+        # laid out as (columns, channels, 2), so a run of hops is one contiguous write for every channel
+        self.buffer = ctx.buffer(np.zeros(self.columns * channels * 2, dtype='f4'), dynamic=True)
         self.vao = ctx.vertex_array(self.prog, self.buffer, 'sample')
         self.prog['x'] = x
         self.prog['y'] = y
-        self.prog['h'] = h
-        self.update()
-        self.sample = 0.002
+        self.prog['h'] = h / channels
+        self.prog['columns'] = self.columns
+        self.prog['channels'] = channels
+        self.prog['offset'] = 0
+
+        self.column = 0     # next slot to write, which is also the oldest one on screen
+        self.pending = []
+        self.sample = np.tile(np.array([-0.002, 0.002], dtype='f4'), (channels, 1))
 
     def add(self, window):
+        # window is one (channels, window_size) hop
         if window is not None:
-            self.sample = np.abs(window[:100]).max()
+            # each hop owns the hop_size samples up to the next window, so every sample is seen once
+            hop = window[:, :self.hop_size]
+            self.sample = np.stack((hop.min(axis=-1), hop.max(axis=-1)), axis=-1).astype('f4')
+
+        self.pending.append(self.sample[:, np.newaxis])
+
+    def add_many(self, windows):
+        count = min(windows.shape[1], self.columns)
+        if count == 0:
+            return
+
+        self.push(self.envelope(windows[:, -count:], self.hop_size))
 
-        self.samples[:-2] = self.samples[2:]
-        self.samples[-2:] = [-self.sample, self.sample]
+    @staticmethod
+    def envelope(windows, hop_size=HOP_SIZE):
+        # (channels, N, window_size) windows to (channels, N, 2) pairs
+        hops = windows[..., :hop_size]
+        return np.stack((hops.min(axis=-1), hops.max(axis=-1)), axis=-1).astype('f4')
+
+    def push(self, samples):
+        # queue (min, max) pairs that were already computed by envelope(), e.g. on the analysis thread
+        if samples.shape[1] == 0:
+            return
+        self.sample = samples[:, -1]
+        self.pending.append(samples[:, -self.columns:])
 
     def update(self):
-        self.buffer.write(self.samples)
+        if not self.pending:
+            return
+
+        samples = np.concatenate(self.pending, axis=1)[:, -self.columns:]
+        self.pending = []
+
+        # write the new pairs in place, split in two where they wrap around the end of the buffer
+        count = samples.shape[1]
+        samples = samples.transpose(1, 0, 2)
+        first = min(count, self.columns - self.column)
+        stride = samples.itemsize * self.channels * 2
+        self.buffer.write(np.ascontiguousarray(samples[:first]), offset=self.column * stride)
+        if first < count:
+            self.buffer.write(np.ascontiguousarray(samples[first:]))
+
+        self.column = (self.column + count) % self.columns
+        self.prog['offset'] = self.column
+        metrics.record("upload_bytes/wave", samples.nbytes)
+        metrics.count("upload_bytes", samples.nbytes)
 
     def size(self, w, h):
         projection = orthographic(w, h)
         self.prog['projection'].write(projection)
 
     def draw(self):
-        self.vao.render(moderngl.LINES)
\ No newline at end of file
+        self.vao.render(moderngl.LINES)
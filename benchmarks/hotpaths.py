@@ -0,0 +1,244 @@
+"""
+Throughput benchmarks for the DSP and render hot paths.
+
+CPU benchmarks cover stft_slice, stft_colour, Source.get/get_many/available, Spectrogram.add/update and
+Wave.add, across several display widths, FFT window sizes and channel counts. GPU benchmarks render full frames of App's
+node graph in a standalone (headless) moderngl context, so they run with software rendering too.
+
+Results are written as JSON and can be compared against a stored baseline, failing when anything got
+slower than the baseline by more than the tolerance.
+
+Usage:
+    python benchmarks/hotpaths.py [--output results.json] [--baseline baseline.json] [--tolerance 0.15]
+    python benchmarks/hotpaths.py --save baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from analysis import Analysis                       # noqa: E402
+from headless import create_context                 # noqa: E402
+from config import WINDOW_SIZE, HOP_SIZE, BUFFER_SIZE, WINDOW_WIDTH, WINDOW_HEIGHT   # noqa: E402
+from features import Features                       # noqa: E402
+from scene import Scene                             # noqa: E402
+from source import ArraySource                      # noqa: E402
+from spectrogram import Spectrogram, stft_slice, stft_colour   # noqa: E402
+from wave import Wave                               # noqa: E402
+
+
+WIDTHS = [800, 1600, 3200]
+WINDOW_SIZES = [512, 1024, 2048, 4096]
+BATCH = 32
+CHANNEL_COUNTS = [1, 2, 4, 8]
+
+
+def noise_source():
+    # looped noise, fed into the ring by hand with feed()
+    noise = np.random.default_rng(0).standard_normal(BUFFER_SIZE * 64).astype('f4') * 0.1
+    return ArraySource(noise, loop=True)
+
+
+class BenchScene(Scene):
+    # keep the DSP on this thread so frame times include it
+    threaded = False
+
+    def __init__(self, ctx):
+        super().__init__()
+        self.ctx = ctx
+
+    def create_source(self):
+        return noise_source()
+
+
+def measure(fn, repeat=5):
+    """
+    Best of repeat runs of the seconds per call of fn, each run long enough to be timed reliably.
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def windows(count, size=WINDOW_SIZE, channels=1):
+    return np.random.default_rng(1).standard_normal((channels, count, size)).astype('f4')
+
+
+def cpu_benchmarks(ctx):
+    results = {}
+
+    # stft at several window sizes
+    for size in WINDOW_SIZES:
+        analysis = Analysis(window_size=size)
+        single, batch = windows(1, size)[0, 0], windows(BATCH, size)[0]
+        slices = stft_slice(batch, analysis)
+        results[f"stft_slice/{size}"] = (measure(lambda: stft_slice(single, analysis)), 1)
+        results[f"stft_slice_batch/{size}"] = (measure(lambda: stft_slice(batch, analysis)), BATCH)
+        results[f"stft_colour/{size}"] = (measure(lambda: stft_colour(slices[0])), 1)
+        results[f"stft_colour_batch/{size}"] = (measure(lambda: stft_colour(slices)), BATCH)
+
+    source = noise_source()
+
+    def get():
+        source.feed(HOP_SIZE)
+        source.get()
+
+    def get_many():
+        source.feed(HOP_SIZE * BATCH)
+        source.get_many(BATCH)
+
+    source.feed(WINDOW_SIZE)
+    results["source_get"] = (measure(get), 1)
+    results["source_get_many"] = (measure(get_many), BATCH)
+    results["source_available"] = (measure(source.available), 1)
+
+    batch = windows(BATCH)
+    for width in WIDTHS:
+        for gpu_colour in (False, True):
+            node = Spectrogram(ctx, 0, 0, width, WINDOW_HEIGHT // 2, gpu_colour=gpu_colour)
+            mode = "gpu" if gpu_colour else "cpu"
+
+            def add_update():
+                node.add(batch[:, 0])
+                node.add(batch[:, 1])
+                node.update()
+                ctx.finish()
+
+            def add_many_update():
+                node.add_many(batch)
+                node.update()
+                ctx.finish()
+
+            results[f"spectrogram_add_update/{mode}/{width}"] = (measure(add_update), 2)
+            results[f"spectrogram_add_many_update/{mode}/{width}"] = (measure(add_many_update), BATCH)
+
+        wave = Wave(ctx, 0, 0, width, WINDOW_HEIGHT // 3)
+        results[f"wave_add/{width}"] = (measure(lambda: wave.add(batch[:, 0])), 1)
+        results[f"wave_add_many/{width}"] = (measure(lambda: wave.add_many(batch)), BATCH)
+        wave.pending = []
+
+    # the same batch across more channels, which share the rfft call, the upload and the draw
+    for channels in CHANNEL_COUNTS:
+        batch = windows(BATCH, channels=channels)
+        node = Spectrogram(ctx, 0, 0, WINDOW_WIDTH, WINDOW_HEIGHT // 2, gpu_colour=True, channels=channels)
+
+        def add_many_update():
+            node.add_many(batch)
+            node.update()
+            node.draw()
+            ctx.finish()
+
+        results[f"spectrogram_channels/{channels}"] = (measure(add_many_update), BATCH)
+
+    # the feature stage on its own, on magnitudes the STFT has already produced
+    batch = windows(BATCH)
+    magnitudes = np.abs(stft_slice(batch, Analysis()))
+    features = Features(Analysis())
+    results["features"] = (measure(lambda: features.add(magnitudes, batch)), BATCH)
+
+    return results
+
+
+def gpu_benchmarks(ctx):
+    results = {}
+
+    fbo = ctx.simple_framebuffer((WINDOW_WIDTH, WINDOW_HEIGHT))
+    fbo.use()
+    scene = BenchScene(ctx)
+    scene.init()
+    scene.win_size(WINDOW_WIDTH, WINDOW_HEIGHT)
+
+    def frame():
+        # two hops of fresh audio per frame, like the live app
+        scene.source.feed(2 * HOP_SIZE)
+        fbo.clear()
+        scene.draw(1 / 60)
+        ctx.finish()
+
+    def render_only():
+        fbo.clear()
+        for node in scene.nodes:
+            node.draw()
+        ctx.finish()
+
+    scene.source.feed(WINDOW_SIZE)
+    results["frame"] = (measure(frame), 2)
+    results["frame_render_only"] = (measure(render_only), 0)
+    return results
+
+
+def run():
+    ctx = create_context()
+    results = {}
+    results.update(cpu_benchmarks(ctx))
+    results.update(gpu_benchmarks(ctx))
+
+    return {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "renderer": ctx.info["GL_RENDERER"],
+        },
+        "results": {
+            name: {
+                "seconds": seconds,
+                "ms": seconds * 1000,
+                "hops_per_sec": hops / seconds if hops else None,
+            }
+            for name, (seconds, hops) in results.items()
+        },
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return the names of benchmarks that are slower than the baseline by more than the tolerance.
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["seconds"]
+        change = result["seconds"] / before - 1
+        flag = "REGRESSION" if change > tolerance else ""
+        print(f"{name:48} {before * 1000:10.4f}ms -> {result['seconds'] * 1000:10.4f}ms {change:+7.1%} {flag}")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--save", help="write the results as a new baseline")
+    parser.add_argument("--baseline", help="compare against this baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown, 0.15 is 15%%")
+    args = parser.parse_args()
+
+    report = run()
+    for name, result in report["results"].items():
+        rate = f"{result['hops_per_sec']:12.0f} hops/s" if result["hops_per_sec"] else ""
+        print(f"{name:48} {result['ms']:10.4f}ms {rate}")
+
+    for path in (args.output, args.save):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"FAIL: {len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
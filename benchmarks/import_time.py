@@ -0,0 +1,63 @@
+"""
+Cold start benchmark for the live path (main -> scene -> source, nodes and the stages hung off them).
+
+Imports the live modules in a fresh interpreter several times and fails if the fastest run is
+slower than the threshold, or if any of the heavy optional modules got pulled in on the way.
+
+Usage: python benchmarks/import_time.py [--threshold SECONDS] [--repeat N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+# everything main.py needs apart from the Qt window, scene brings in the source, the nodes, the cache, the
+# analysis worker, the recorder, the history and the features
+LIVE_MODULES = ["scene", "analysis", "source", "spectrogram", "wave", "rect", "ticks", "text"]
+
+# modules that must only ever be imported lazily
+HEAVY_MODULES = ["librosa", "matplotlib"]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import {modules}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure():
+    code = CHILD.format(modules=", ".join(LIVE_MODULES), heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=1.0, help="maximum cold start in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.repeat)]
+    best = min(run["seconds"] for run in runs)
+    heavy = sorted({m for run in runs for m in run["heavy"]})
+
+    print(f"cold start: {best:.3f}s (threshold {args.threshold:.3f}s)")
+    failed = False
+    if best > args.threshold:
+        print("FAIL: cold start is above the threshold")
+        failed = True
+    if heavy:
+        print(f"FAIL: heavy modules imported on the live path: {', '.join(heavy)}")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()